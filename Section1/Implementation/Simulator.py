@@ -8,6 +8,21 @@ from pygame import Surface
 from pygame.time import Clock
 
 
+# Palette of the bodies, indexed by id, built once at import time. Ids past the end are white.
+PLANET_COLORS = (
+    (255, 255, 0),  # Sun (Yellow)
+    (169, 169, 169),  # Mercury (Grey)
+    (255, 140, 0),  # Venus (Orange)
+    (0, 0, 255),  # Earth (Blue)
+    (255, 0, 0),  # Mars (Red)
+    (255, 215, 0),  # Jupiter (Golden)
+    (139, 69, 19),  # Saturn (Brown)
+    (0, 255, 255),  # Uranus (Cyan)
+    (0, 0, 139),  # Neptune (Dark Blue)
+    (255, 255, 255)  # Any other body (White)
+)
+
+
 def create_planet(id: int, x: float, y: float, radius: float,
                   center_x: float = None, center_y: float = None, angle_speed: float = None) -> dict:
     """Return a planet dictionary with the given parameters
@@ -59,18 +74,29 @@ def update_color(planet: dict) -> None:
     Preconditions:
       - planet['id'] != None
     """
-    colors = [
-        (255, 255, 0),  # Sun (Yellow)
-        (169, 169, 169),  # Mercury (Grey)
-        (255, 140, 0),  # Venus (Orange)
-        (0, 0, 255),  # Earth (Blue)
-        (255, 0, 0),  # Mars (Red)
-        (255, 215, 0),  # Jupiter (Golden)
-        (139, 69, 19),  # Saturn (Brown)
-        (0, 255, 255),  # Uranus (Cyan)
-        (0, 0, 139)  # Neptune (Dark Blue)
-    ]
-    planet['color'] = colors[planet['id']] if planet['id'] < len(colors) else (255, 255, 255)
+    planet['color'] = PLANET_COLORS[min(planet['id'], len(PLANET_COLORS) - 1)]
+
+
+def update_colors(objects: list, previous: np.ndarray = None) -> np.ndarray:
+    """Update the color of all the objects at once and return their palette indices
+
+    The palette index of every object is computed with one vectorized comparison, and only the
+    objects whose index differs from previous get their color looked up again.
+    >>> objects = [create_planet(3, 4, 4, 30, 0, 0, 5), create_planet(42, 4, 4, 30, 0, 0, 5)]
+    >>> update_colors(objects).tolist()
+    [3, 9]
+    >>> objects[0]['color'], objects[1]['color']
+    ((0, 0, 255), (255, 255, 255))
+
+    Preconditions:
+      - previous is None or len(previous) == len(objects)
+    """
+    ids = np.fromiter((obj['id'] for obj in objects), dtype=np.int64, count=len(objects))
+    indices = np.minimum(ids, len(PLANET_COLORS) - 1)
+    changed = range(len(objects)) if previous is None else np.flatnonzero(indices != previous)
+    for i in changed:
+        objects[i]['color'] = PLANET_COLORS[indices[i]]
+    return indices
 
 
 def init_pygame(width: float, height: float)-> Surface | Clock:
@@ -111,6 +137,7 @@ def run_simulation(width: float, height: float, time_step: float, astronomical_o
     """
     screen, clock = init_pygame(width, height)
     frames = []
+    color_indices = None
     running = True
     while running:
         for event in pygame.event.get():
@@ -124,8 +151,7 @@ def run_simulation(width: float, height: float, time_step: float, astronomical_o
             elif 'speed' in obj:
                 move_meteor(obj, time_step, width, height, random.uniform(500, 1000))
 
-        for obj in astronomical_objects:
-            update_color(obj)
+        color_indices = update_colors(astronomical_objects, color_indices)
 
         # Draw everything
         draw(screen, astronomical_objects)
@@ -4,6 +4,26 @@ import math
 import numpy as np
 import imageio
 import random
+import os
+
+# The helpers shared by the Section 2 simulators live in Section2/Implementation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simulation_helpers import compute_init_positions_batch, random_state, set_random_state
+
+
+# Palette of the bodies, indexed by id, built once at import time. Ids past the end are white.
+PLANET_COLORS = (
+    (255, 255, 0),  # Sun (Yellow)
+    (169, 169, 169),  # Mercury (Grey)
+    (255, 140, 0),  # Venus (Orange)
+    (0, 0, 255),  # Earth (Blue)
+    (255, 0, 0),  # Mars (Red)
+    (255, 215, 0),  # Jupiter (Golden)
+    (139, 69, 19),  # Saturn (Brown)
+    (0, 255, 255),  # Uranus (Cyan)
+    (0, 0, 139),  # Neptune (Dark Blue)
+    (255, 255, 255)  # Any other body (White)
+)
 
 
 def create_planet(id: int, x: float, y: float, radius: float, shape: str,
@@ -106,18 +126,23 @@ def move_meteor(meteor, time_step, screen_width, screen_height, max_distance=500
 
 
 def update_color(planet):
-    colors = [
-        (255, 255, 0),  # Sun (Yellow)
-        (169, 169, 169),  # Mercury (Grey)
-        (255, 140, 0),  # Venus (Orange)
-        (0, 0, 255),  # Earth (Blue)
-        (255, 0, 0),  # Mars (Red)
-        (255, 215, 0),  # Jupiter (Golden)
-        (139, 69, 19),  # Saturn (Brown)
-        (0, 255, 255),  # Uranus (Cyan)
-        (0, 0, 139)  # Neptune (Dark Blue)
-    ]
-    planet['color'] = colors[planet['id']] if planet['id'] < len(colors) else (255, 255, 255)
+    planet['color'] = PLANET_COLORS[min(planet['id'], len(PLANET_COLORS) - 1)]
+
+
+def update_colors(objects, previous=None):
+    """Update the color of all the objects at once and return their palette indices
+
+    Only the objects whose palette index differs from previous get their color looked up again.
+    >>> objects = [create_planet(3, 4, 4, 30, 'circle', 0, 0, 5), create_meteor(12, 100, 100, 3, 'circle', 2)]
+    >>> update_colors(objects).tolist()
+    [3, 9]
+    """
+    ids = np.fromiter((obj['id'] for obj in objects), dtype=np.int64, count=len(objects))
+    indices = np.minimum(ids, len(PLANET_COLORS) - 1)
+    changed = range(len(objects)) if previous is None else np.flatnonzero(indices != previous)
+    for i in changed:
+        objects[i]['color'] = PLANET_COLORS[indices[i]]
+    return indices
 
 
 def init_pygame(width, height):
@@ -142,6 +167,7 @@ def draw(screen, objects):
 def run_simulation(width, height, time_step, objects, save_gif=False, gif_name='simulation.gif'):
     screen, clock = init_pygame(width, height)
     frames = []
+    color_indices = None
     running = True
     while running:
         for event in pygame.event.get():
@@ -155,8 +181,7 @@ def run_simulation(width, height, time_step, objects, save_gif=False, gif_name='
             elif 'speed' in obj:
                 move_meteor(obj, time_step, width, height, random.uniform(500, 1000))
 
-        for obj in objects:
-            update_color(obj)
+        color_indices = update_colors(objects, color_indices)
 
         # Draw everything
         draw(screen, objects)
@@ -183,30 +208,55 @@ def compute_init_positions(screen_height: int, screen_width: int, solar_distance
     >>> compute_init_positions(558,992,[31, 31, 31, 31, 62, 31, 31, 31])
     [(527.0, 279), (558.0, 279), (589.0, 279), (620.0, 279), (682.0, 279), (713.0, 279), (744.0, 279), (775.0, 279)]
     """
+    init_pos = compute_init_positions_batch(screen_height, screen_width, [solar_distances])
+    return [(distance, screen_height // 2) for distance in init_pos[:, 0].tolist()]
+
+
+def save_snapshot(path, objects):
+    """Save the planets, the meteors and the state of the random generator to the .npz file at path
+
+    Planets and meteors have different keys, so each kind is stored as its own group of columns
+    together with the kind of every object to restore their order. Nothing is pickled.
 
-    # Check the precondition
-    assert solar_distances != []
-    assert screen_height != 0
-    assert screen_width != 0
-
-    # Compute the distance between the sun and the last planet
-    furthest_planet_distance = sum(solar_distances)
-    # Compute the screen size
-    screen_size = min(screen_height, screen_width) // 2
-
-    # Compute the scaling factor
-    scaling_factor = screen_size / furthest_planet_distance
-    screen_distances = [distance * scaling_factor for distance in solar_distances]
-    # Compute the distance between each planet and sun (the center)
-    distance_to_sun_in_screen = 0
-    init_pos = []
-    for s_dist in screen_distances:
-        distance_to_sun_in_screen += s_dist
-        init_pos.append((distance_to_sun_in_screen + screen_width // 2, screen_height // 2))
-
-        assert distance_to_sun_in_screen <= screen_size
-
-    return init_pos
+    Preconditions:
+      - every object was created with create_planet or create_meteor
+    """
+    kinds = ['planet' if 'orbit_radius' in obj else 'meteor' for obj in objects]
+    arrays = {'kinds': np.array(kinds)}
+    for kind in ('planet', 'meteor'):
+        group = [obj for obj, obj_kind in zip(objects, kinds) if obj_kind == kind]
+        if group:
+            for key in group[0]:
+                arrays[kind + '/' + key] = np.array([obj[key] for obj in group])
+    arrays.update(random_state())
+    np.savez(path, **arrays)
+
+
+def load_snapshot(path):
+    """Return the objects saved by save_snapshot in their original order and restore the random generator
+    >>> import os, tempfile
+    >>> objects = [create_planet(0, 4, 4, 30, 'circle', 0, 0, 5), create_meteor(1, 100, 100, 3, 'circle', 2)]
+    >>> path = os.path.join(tempfile.mkdtemp(), 'snapshot.npz')
+    >>> save_snapshot(path, objects)
+    >>> load_snapshot(path) == objects
+    True
+    """
+    groups = {}
+    with np.load(path) as arrays:
+        kinds = arrays['kinds'].tolist()
+        for name in arrays.files:
+            if '/' in name:
+                kind, key = name.split('/', 1)
+                groups.setdefault(kind, {})[key] = arrays[name].tolist()
+        set_random_state(arrays)
+
+    rows = {kind: zip(*columns.values()) for kind, columns in groups.items()}
+    objects = []
+    for kind in kinds:
+        obj = dict(zip(groups[kind], next(rows[kind])))
+        obj['color'] = tuple(obj['color'])
+        objects.append(obj)
+    return objects
 
 
 # Example usage
@@ -4,6 +4,34 @@ import math
 import numpy as np
 import imageio
 import random
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The helpers shared by the Section 2 simulators live in Section2/Implementation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simulation_helpers import (compute_init_positions_batch, pack_objects, unpack_objects, random_state,
+                                set_random_state, run_sweep, splat_points, save_scenario)
+
+
+# Palette registry, built once at import time: the default white, then the star and the planet colors
+WHITE = (255, 255, 255)
+STAR_COLORS = (
+    (255, 255, 0),  # Sun (Yellow)
+)
+PLANET_COLORS = (
+    (169, 169, 169),  # Mercury (Grey)
+    (255, 140, 0),  # Venus (Orange)
+    (0, 0, 255),  # Earth (Blue)
+    (255, 0, 0),  # Mars (Red)
+    (255, 215, 0),  # Jupiter (Golden)
+    (139, 69, 19),  # Saturn (Brown)
+    (0, 255, 255),  # Uranus (Cyan)
+    (0, 0, 139)  # Neptune (Dark Blue)
+)
+PALETTE = (WHITE,) + STAR_COLORS + PLANET_COLORS
+PALETTE_RGB = np.array(PALETTE, dtype=np.float32)  # the palette as an (n, 3) array, indexed by palette index
 
 
 class AstronomicalBody:
@@ -36,13 +64,16 @@ class AstronomicalBody:
 
 class Planet(AstronomicalBody):
     def __init__(self, id: int, x: float, y: float, radius: float, type: str, center_x: float, center_y: float,
-                 orbit_radius: float, angle_speed: float):
+                 orbit_radius: float, angle_speed: float, parent: int = -1):
         super().__init__(id, x, y, radius, type)
         self.center_x = center_x
         self.center_y = center_y
         self.orbit_radius = orbit_radius
         self.angle = math.atan2(y - center_y, x - center_x) if center_x is not None and center_y is not None else 0
         self.angle_speed = angle_speed
+        # Index of the body this one orbits in the simulator's body list, or -1 to orbit the fixed center.
+        # The simulator moves the center along with the parent, move() alone keeps it fixed.
+        self.parent = parent
 
     def move(self, time_step: float):
         if self.orbit_radius is not None:
@@ -51,17 +82,7 @@ class Planet(AstronomicalBody):
             self.y = self.center_y + self.orbit_radius * math.sin(self.angle)
 
     def get_color(self):
-        colors = [
-            (169, 169, 169),  # Mercury (Grey)
-            (255, 140, 0),  # Venus (Orange)
-            (0, 0, 255),  # Earth (Blue)
-            (255, 0, 0),  # Mars (Red)
-            (255, 215, 0),  # Jupiter (Golden)
-            (139, 69, 19),  # Saturn (Brown)
-            (0, 255, 255),  # Uranus (Cyan)
-            (0, 0, 139)  # Neptune (Dark Blue)
-        ]
-        self.color = colors[self.id] if self.id < len(colors) else (255, 255, 255)
+        self.color = PLANET_COLORS[self.id] if self.id < len(PLANET_COLORS) else WHITE
         return self.color
 
 
@@ -74,18 +95,19 @@ class Star(AstronomicalBody):
         self.y = self.y
 
     def get_color(self):
-        colors = [
-            (255, 255, 0),  # Sun (Yellow)
-        ]
-        self.color = colors[self.id] if self.id < len(colors) else (255, 255, 255)
+        self.color = STAR_COLORS[self.id] if self.id < len(STAR_COLORS) else WHITE
         return self.color
 
 
 class Meteor(AstronomicalBody):
-    def __init__(self, id: int, x: float, y: float, radius: float, type: str, speed: float, max_distance: float):
+    def __init__(self, id: int, x: float, y: float, radius: float, type: str, speed: float, max_distance: float,
+                 screen_width: float = 16 * 80, screen_height: float = 9 * 80):
         super().__init__(id, x, y, radius, type)
         self.speed = speed
         self.max_distance = max_distance
+        # the meteor respawns inside the screen after max_distance, by default the screen of __main__
+        self.screen_width = screen_width
+        self.screen_height = screen_height
         self.delta_x = 0
         self.delta_y = 0
         self.traveled_distance = 0
@@ -106,12 +128,366 @@ class Meteor(AstronomicalBody):
             # Reset the distance traveled
             self.traveled_distance = 0
             # Randomly reposition the meteor
-            self.x = random.uniform(0, screen_width)
-            self.y = random.uniform(0, screen_height)
+            self.x = random.uniform(0, self.screen_width)
+            self.y = random.uniform(0, self.screen_height)
+
+
+class OrbitHierarchy:
+    """
+    Move all the planets of a body list at once, in vectorized passes. A planet whose parent is another
+    body orbits that body's current position, so moons follow their planets, and planets without a
+    parent orbit their fixed center exactly like Planet.move. The planets are grouped by depth and the
+    levels are evaluated in order, so every center is known before the bodies orbiting it are moved,
+    and the cost is linear in the number of bodies whatever the depth.
+    The orbit state is copied from the planets when the hierarchy is built and written back after
+    every move, so a hierarchy has to be rebuilt when orbits are changed from outside.
+    """
+
+    def __init__(self, bodies):
+        self.count = len(bodies)
+        self.rows = np.array([i for i, body in enumerate(bodies)
+                              if isinstance(body, Planet) and body.orbit_radius is not None], dtype=np.int64)
+        self.others = [body for body in bodies if not isinstance(body, Planet) or body.orbit_radius is None]
+        planets = [bodies[i] for i in self.rows]
+        self.parents = np.array([getattr(planet, 'parent', -1) for planet in planets], dtype=np.int64)
+        if np.any((self.parents < -1) | (self.parents >= self.count)) or np.any(self.parents == self.rows):
+            raise ValueError("Invalid orbit parent")
+        self.orbit_radius = np.array([planet.orbit_radius for planet in planets], dtype=np.float64)
+        self.angle_speed = np.array([planet.angle_speed for planet in planets], dtype=np.float64)
+        self.angle = np.array([planet.angle for planet in planets], dtype=np.float64)
+        self.center_x = np.array([planet.center_x for planet in planets], dtype=np.float64)
+        self.center_y = np.array([planet.center_y for planet in planets], dtype=np.float64)
+
+        # Depth of every planet: 0 when it orbits a fixed center or a body that is not a planet
+        position = np.full(self.count, -1)
+        position[self.rows] = np.arange(len(self.rows))
+        parent_positions = np.where(self.parents >= 0, position[np.maximum(self.parents, 0)], -1)
+        depth = np.where(parent_positions < 0, 0, -1)
+        while np.any(depth < 0):
+            known = (depth < 0) & (depth[np.maximum(parent_positions, 0)] >= 0)
+            if not np.any(known):
+                raise ValueError("Orbit parents form a cycle")
+            depth[known] = depth[parent_positions[known]] + 1
+        self.levels = [np.flatnonzero(depth == level) for level in range(int(depth.max(initial=-1)) + 1)]
+
+    def move(self, bodies, time_step):
+        """
+        Advance the planets of bodies by time_step, after the other bodies have been moved
+        """
+        xs = np.fromiter((body.x for body in bodies), dtype=np.float64, count=self.count)
+        ys = np.fromiter((body.y for body in bodies), dtype=np.float64, count=self.count)
+        self.angle += self.angle_speed * time_step
+        for level in self.levels:
+            parents = self.parents[level]
+            followed = level[parents >= 0]
+            self.center_x[followed] = xs[self.parents[followed]]
+            self.center_y[followed] = ys[self.parents[followed]]
+            rows = self.rows[level]
+            xs[rows] = self.center_x[level] + self.orbit_radius[level] * np.cos(self.angle[level])
+            ys[rows] = self.center_y[level] + self.orbit_radius[level] * np.sin(self.angle[level])
+
+        for i, x, y, angle, center_x, center_y in zip(self.rows.tolist(), xs[self.rows].tolist(),
+                                                      ys[self.rows].tolist(), self.angle.tolist(),
+                                                      self.center_x.tolist(), self.center_y.tolist()):
+            planet = bodies[i]
+            planet.x = x
+            planet.y = y
+            planet.angle = angle
+            planet.center_x = center_x
+            planet.center_y = center_y
+
+
+def _direct_rows(xs, ys, masses, start, stop, softening, block):
+    """
+    Return the accelerations of the bodies start to stop from every body, for a gravitational constant
+    of 1, going through the other bodies block by block so only block x block pair arrays are allocated
+    """
+    ax = np.zeros(stop - start)
+    ay = np.zeros(stop - start)
+    row_x = xs[start:stop, None]
+    row_y = ys[start:stop, None]
+    for column in range(0, len(xs), block):
+        end = min(column + block, len(xs))
+        dx = xs[None, column:end] - row_x
+        dy = ys[None, column:end] - row_y
+        distances_squared = dx * dx
+        distances_squared += dy * dy
+        distances_squared += softening * softening
+        # A body does not pull itself
+        same = np.arange(max(start, column), min(stop, end))
+        distances_squared[same - start, same - column] = np.inf
+        weights = masses[None, column:end] / (distances_squared * np.sqrt(distances_squared))
+        ax += np.einsum('ij,ij->i', weights, dx)
+        ay += np.einsum('ij,ij->i', weights, dy)
+    return ax, ay
+
+
+def direct_accelerations(xs, ys, masses, gravitational_constant=1.0, softening=1.0, block=512, pool=None):
+    """
+    Return the x and y gravitational accelerations of every body from every other body, summing all the
+    n^2 pairs. The softening length is added to every distance to keep close encounters finite.
+    The pair matrix is computed in block x block tiles, so memory stays around a few block^2 floats per
+    worker instead of n^2, and the row blocks are spread over the threads of pool if one is given
+    (NumPy releases the GIL while it computes a tile). The pool is reused across calls, not shut down
+    """
+    count = len(xs)
+    starts = range(0, count, block)
+    if pool is not None and count > block:
+        parts = list(pool.map(lambda start: _direct_rows(xs, ys, masses, start, min(start + block, count),
+                                                         softening, block), starts))
+    else:
+        parts = [_direct_rows(xs, ys, masses, start, min(start + block, count), softening, block)
+                 for start in starts]
+    if not parts:
+        return np.zeros(0), np.zeros(0)
+    ax = np.concatenate([part[0] for part in parts])
+    ay = np.concatenate([part[1] for part in parts])
+    return gravitational_constant * ax, gravitational_constant * ay
+
+
+def _spread_bits(values):
+    """
+    Move bit k of every value to bit 2k, so two spread values can be interleaved into a Morton code
+    """
+    spread = values.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        spread = (spread | (spread << np.uint64(shift))) & np.uint64(mask)
+    return spread
+
+
+def barnes_hut_accelerations(xs, ys, masses, gravitational_constant=1.0, softening=1.0, theta=0.5, max_depth=20):
+    """
+    Return the same accelerations as direct_accelerations in O(n log n), approximating every group of
+    bodies that is seen under an angle smaller than theta (cell size / distance) by its center of mass.
+    theta = 0 opens every cell and gives the direct sum up to rounding.
+    The quadtree is built level by level from the sorted Morton codes of the bodies, and it is walked
+    for all the bodies at once: every round handles the whole frontier of (body, cell) pairs with array
+    operations, accepting the far cells and replacing the others by their children.
+    >>> rng = np.random.default_rng(0)
+    >>> xs, ys, masses = rng.uniform(0, 100, 300), rng.uniform(0, 100, 300), rng.uniform(1, 5, 300)
+    >>> exact = direct_accelerations(xs, ys, masses, softening=0.5)
+    >>> approximate = barnes_hut_accelerations(xs, ys, masses, softening=0.5, theta=0)
+    >>> bool(np.allclose(approximate, exact, rtol=1e-9, atol=1e-12))
+    True
+    >>> barnes_hut_accelerations(np.zeros(0), np.zeros(0), np.zeros(0))
+    (array([], dtype=float64), array([], dtype=float64))
+    """
+    count = len(xs)
+    if count == 0:
+        return np.zeros(0), np.zeros(0)
+    x0, y0 = xs.min(), ys.min()
+    extent = max(xs.max() - x0, ys.max() - y0) or 1.0
+    cells = 1 << max_depth
+    ix = np.minimum(((xs - x0) * (cells / extent)).astype(np.int64), cells - 1)
+    iy = np.minimum(((ys - y0) * (cells / extent)).astype(np.int64), cells - 1)
+    codes = _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    sorted_masses = masses[order]
+
+    # One level of cells per depth, until every cell holds a single body
+    keys, starts, depths, node_of_body = [], [], [], []
+    for depth in range(max_depth + 1):
+        level_keys = codes >> np.uint64(2 * (max_depth - depth))
+        first = np.flatnonzero(np.r_[True, level_keys[1:] != level_keys[:-1]])
+        node_of_sorted = np.repeat(np.arange(len(first)), np.diff(np.r_[first, count]))
+        level_nodes = np.empty(count, dtype=np.int64)
+        level_nodes[order] = sum(len(level) for level in keys) + node_of_sorted
+        keys.append(level_keys[first])
+        starts.append(first)
+        depths.append(np.full(len(first), depth))
+        node_of_body.append(level_nodes)
+        if len(first) == count:
+            break
+    offsets = np.cumsum([0] + [len(level) for level in keys])
+    node_counts = np.concatenate([np.diff(np.r_[first, count]) for first in starts])
+    mass = np.concatenate([np.add.reduceat(sorted_masses, first) for first in starts])
+    mass_x = np.concatenate([np.add.reduceat(sorted_masses * xs[order], first) for first in starts])
+    mass_y = np.concatenate([np.add.reduceat(sorted_masses * ys[order], first) for first in starts])
+    depth = np.concatenate(depths)
+    safe_mass = np.where(mass > 0, mass, 1)
+    center_x = np.where(mass > 0, mass_x / safe_mass, np.concatenate([xs[order][first] for first in starts]))
+    center_y = np.where(mass > 0, mass_y / safe_mass, np.concatenate([ys[order][first] for first in starts]))
+    size_squared = (extent / 2.0 ** depth) ** 2
+    leaf = (node_counts == 1) | (depth == len(keys) - 1)
+    # The children of a cell are the contiguous cells of the next level whose key starts with its key
+    child_start = np.zeros(len(depth), dtype=np.int64)
+    child_count = np.zeros(len(depth), dtype=np.int64)
+    for level in range(len(keys) - 1):
+        parent_keys = keys[level + 1] >> np.uint64(2)
+        left = np.searchsorted(parent_keys, keys[level], 'left')
+        child_start[offsets[level]:offsets[level + 1]] = offsets[level + 1] + left
+        child_count[offsets[level]:offsets[level + 1]] = np.searchsorted(parent_keys, keys[level], 'right') - left
+    node_of_body = np.array(node_of_body)
+
+    ax = np.zeros(count)
+    ay = np.zeros(count)
+    bodies = np.arange(count)
+    nodes = np.zeros(count, dtype=np.int64)
+    while len(bodies):
+        dx = center_x[nodes] - xs[bodies]
+        dy = center_y[nodes] - ys[bodies]
+        accept = leaf[nodes] | (size_squared[nodes] < theta * theta * (dx * dx + dy * dy))
+
+        body, node = bodies[accept], nodes[accept]
+        # A cell that holds the body itself pulls with the mass of the other bodies only
+        own = node_of_body[depth[node], body] == node
+        other_mass = mass[node] - np.where(own, masses[body], 0)
+        pulls = other_mass > 0
+        body, node, own, other_mass = body[pulls], node[pulls], own[pulls], other_mass[pulls]
+        pull_x = (mass[node] * center_x[node] - np.where(own, masses[body] * xs[body], 0)) / other_mass - xs[body]
+        pull_y = (mass[node] * center_y[node] - np.where(own, masses[body] * ys[body], 0)) / other_mass - ys[body]
+        weights = other_mass / (pull_x * pull_x + pull_y * pull_y + softening * softening) ** 1.5
+        ax += np.bincount(body, weights * pull_x, minlength=count)
+        ay += np.bincount(body, weights * pull_y, minlength=count)
+
+        # Replace the cells that are too close by their children
+        body, node = bodies[~accept], nodes[~accept]
+        children = child_count[node]
+        first_child = np.repeat(child_start[node], children)
+        bodies = np.repeat(body, children)
+        nodes = first_child + np.arange(len(bodies)) - np.repeat(np.cumsum(children) - children, children)
+    return gravitational_constant * ax, gravitational_constant * ay
+
+
+class GravitySystem:
+    """
+    Move the bodies under their mutual gravity instead of along their kinematic paths, integrating with
+    velocity Verlet (kick-drift-kick leapfrog), which is symplectic, so the energy of a bound system does
+    not drift over long runs.
+    The mass of a body is its mass attribute, or its radius squared. Its starting velocity is its vx and
+    vy attributes, or the velocity of its kinematic motion: along its orbit for a planet, (speed, speed)
+    for a meteor, and zero otherwise. The positions and velocities are written back to the bodies (as x,
+    y, vx and vy) after every step, so snapshots keep them.
+    method is 'barnes_hut' or 'direct', the O(n^2) sum that can be used to validate the approximation,
+    which runs on a pool of workers threads, one per CPU by default, created once for every step. Call
+    close to shut the pool down
+    """
+
+    def __init__(self, bodies, gravitational_constant=1.0, softening=1.0, theta=0.5, method='barnes_hut',
+                 workers=None):
+        if method not in ('barnes_hut', 'direct'):
+            raise ValueError("Invalid gravity method")
+        self.count = len(bodies)
+        self.gravitational_constant = gravitational_constant
+        self.softening = softening
+        self.theta = theta
+        self.method = method
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self._pool = ThreadPoolExecutor(max_workers=self.workers) if method == 'direct' and self.workers > 1 else None
+        self.xs = np.array([body.x for body in bodies], dtype=np.float64)
+        self.ys = np.array([body.y for body in bodies], dtype=np.float64)
+        self.masses = np.array([getattr(body, 'mass', body.radius ** 2) for body in bodies], dtype=np.float64)
+        velocities = np.array([self.initial_velocity(body) for body in bodies], dtype=np.float64).reshape(-1, 2)
+        self.vxs = velocities[:, 0].copy()
+        self.vys = velocities[:, 1].copy()
+        self.axs, self.ays = self.accelerations()
+
+    @staticmethod
+    def initial_velocity(body):
+        if hasattr(body, 'vx'):
+            return body.vx, body.vy
+        if isinstance(body, Planet) and body.orbit_radius is not None:
+            speed = body.angle_speed * body.orbit_radius
+            return -speed * math.sin(body.angle), speed * math.cos(body.angle)
+        if isinstance(body, Meteor):
+            return body.speed, body.speed
+        return 0.0, 0.0
+
+    def accelerations(self):
+        if self.method == 'direct':
+            return direct_accelerations(self.xs, self.ys, self.masses, self.gravitational_constant, self.softening,
+                                        pool=self._pool)
+        return barnes_hut_accelerations(self.xs, self.ys, self.masses, self.gravitational_constant,
+                                        self.softening, self.theta)
+
+    def close(self):
+        """
+        Shut down the thread pool of the direct sum, if there is one
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def energy(self):
+        """
+        Return the kinetic plus potential energy of the bodies, which the integrator keeps nearly constant
+        >>> sun, planet = Star(0, 0.0, 0.0, 10, 'star'), Star(1, 100.0, 0.0, 1, 'star')
+        >>> sun.mass, sun.vx, sun.vy, planet.mass, planet.vx, planet.vy = 1000.0, 0.0, 0.0, 1.0, 0.0, 3.0
+        >>> system = GravitySystem([sun, planet], method='direct')
+        >>> start = system.energy()
+        >>> for _ in range(2000):
+        ...     system.step([sun, planet], 0.05)
+        >>> bool(abs(system.energy() - start) < 1e-5 * abs(start))
+        True
+        """
+        kinetic = 0.5 * np.sum(self.masses * (self.vxs ** 2 + self.vys ** 2))
+        potential = 0.0
+        block = 512
+        for start in range(0, self.count, block):
+            stop = min(start + block, self.count)
+            dx = self.xs[None, :] - self.xs[start:stop, None]
+            dy = self.ys[None, :] - self.ys[start:stop, None]
+            distances = np.sqrt(dx * dx + dy * dy + self.softening ** 2)
+            distances[np.arange(stop - start), np.arange(start, stop)] = np.inf
+            potential -= np.sum(self.masses[None, :] * self.masses[start:stop, None] / distances)
+        return kinetic + 0.5 * self.gravitational_constant * potential
+
+    def step(self, bodies, time_step):
+        half_step = 0.5 * time_step
+        self.vxs += self.axs * half_step
+        self.vys += self.ays * half_step
+        self.xs += self.vxs * time_step
+        self.ys += self.vys * time_step
+        self.axs, self.ays = self.accelerations()
+        self.vxs += self.axs * half_step
+        self.vys += self.ays * half_step
+        for body, x, y, vx, vy in zip(bodies, self.xs.tolist(), self.ys.tolist(), self.vxs.tolist(),
+                                      self.vys.tolist()):
+            body.x = x
+            body.y = y
+            body.vx = vx
+            body.vy = vy
+
+
+class AdaptiveTimeStep:
+    """
+    Choose every gravity step from the largest acceleration of the bodies: the step is
+    accuracy * sqrt(length / max |a|), the time a body takes to move a fraction of length from rest, clamped
+    between min_step and max_step. Close encounters get short steps and quiet stretches long ones.
+    length defaults to the softening of the system. The leapfrog is not symplectic with a changing step,
+    so the energy drifts a little more than with a fixed step, and history keeps the (simulation time,
+    step) of every step chosen so far
+    """
+
+    def __init__(self, min_step, max_step, accuracy=0.1, length=None):
+        if not 0 < min_step <= max_step or accuracy <= 0:
+            raise ValueError("Invalid adaptive time step bounds")
+        self.min_step = min_step
+        self.max_step = max_step
+        self.accuracy = accuracy
+        self.length = length
+        self.history = []
+
+    def choose(self, gravity, simulation_time):
+        """
+        Return the next step of the GravitySystem gravity, from the accelerations of its last step
+        """
+        length = gravity.softening if self.length is None else self.length
+        largest = np.sqrt(np.max(gravity.axs ** 2 + gravity.ays ** 2, initial=0.0))
+        step = self.max_step if largest == 0 else self.accuracy * math.sqrt(length / largest)
+        step = min(max(step, self.min_step), self.max_step)
+        self.history.append((simulation_time, step))
+        return step
 
 
 class Simulator:
-    def __init__(self, width, height, time_step, astronomical_bodies, save_gif=False, gif_name='simulation.gif'):
+    def __init__(self, width, height, time_step, astronomical_bodies, save_gif=False, gif_name='simulation.gif',
+                 lod_threshold=None, lod_radius=2, gravity=None, gravitational_constant=1.0, softening=1.0,
+                 theta=0.5, gravity_workers=None, step_controller=None):
+        if gravity not in (None, 'barnes_hut', 'direct'):
+            raise ValueError("Invalid gravity method")
         self.width = width
         self.height = height
         self.time_step = time_step
@@ -119,20 +495,94 @@ class Simulator:
         self.save_gif = save_gif
         self.gif_name = gif_name
         self.frames = []
+        self.lod_threshold = lod_threshold  # body count from which small bodies are drawn as points
+        self.lod_radius = lod_radius  # largest radius of a body drawn as a point
+        self._color_kinds = np.empty(0, dtype=np.int64)  # 1 for stars, 2 for planets, 0 for other bodies
+        self._color_indices = np.empty(0, dtype=np.int64)  # palette index of every body, -1 keeps its own color
+        self._colors = np.empty((0, 3), dtype=np.float32)  # RGB of every body, for splatting
+        self._orbits = None  # OrbitHierarchy of the bodies, rebuilt when bodies are added or restored
+        self.gravity = gravity  # None for kinematic orbits, else the GravitySystem method moving the bodies
+        self.gravitational_constant = gravitational_constant
+        self.softening = softening  # length added to every distance so close encounters stay finite
+        self.theta = theta  # opening angle of the Barnes-Hut approximation
+        self.gravity_workers = gravity_workers  # threads summing the direct gravity, None for one per CPU
+        self._gravity = None  # GravitySystem of the bodies, rebuilt when bodies are added or restored
+        self.step_controller = step_controller  # AdaptiveTimeStep choosing every gravity step, None for fixed steps
+        self.simulation_time = 0.0  # sum of the time steps run so far
 
     def init_pygame(self):
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height))
         self.clock = pygame.time.Clock()
 
+    def move_bodies(self):
+        """
+        Move the bodies that are not planets one by one, then all the planets and moons level by level.
+        In gravity mode, move all the bodies under their mutual gravity instead, with the step chosen by
+        the step controller if there is one. Kinematic orbits are exact for any step, so they keep time_step
+        """
+        bodies = self.astronomical_bodies
+        if self.gravity is not None:
+            if self._gravity is None or self._gravity.count != len(bodies):
+                self.close()
+                self._gravity = GravitySystem(bodies, self.gravitational_constant, self.softening, self.theta,
+                                              self.gravity, self.gravity_workers)
+            if self.step_controller is not None:
+                self.time_step = self.step_controller.choose(self._gravity, self.simulation_time)
+            self._gravity.step(bodies, self.time_step)
+            self.simulation_time += self.time_step
+            return
+        if self._orbits is None or self._orbits.count != len(bodies):
+            self._orbits = OrbitHierarchy(bodies)
+        for body in self._orbits.others:
+            body.move(self.time_step)
+        self._orbits.move(bodies, self.time_step)
+        self.simulation_time += self.time_step
+
+    def update_colors(self):
+        """
+        Resolve the palette index of every body with one vectorized comparison, and only look up the
+        color of the bodies whose index changed. The colors are also kept as an array for draw, where the
+        bodies without a palette index keep the color they had when the body list was last changed
+        """
+        bodies = self.astronomical_bodies
+        if len(self._color_kinds) != len(bodies):
+            self._color_kinds = np.array([1 if isinstance(body, Star) else 2 if isinstance(body, Planet) else 0
+                                          for body in bodies], dtype=np.int64)
+            self._color_indices = np.full(len(bodies), -2)
+            self._colors = np.array([body.color for body in bodies], dtype=np.float32).reshape(-1, 3)
+        ids = np.fromiter((body.id for body in bodies), dtype=np.int64, count=len(bodies))
+        star_indices = np.where(ids < len(STAR_COLORS), 1 + ids, 0)
+        planet_indices = np.where(ids < len(PLANET_COLORS), 1 + len(STAR_COLORS) + ids, 0)
+        indices = np.select([self._color_kinds == 1, self._color_kinds == 2], [star_indices, planet_indices], -1)
+        changed = np.flatnonzero((indices != self._color_indices) & (indices >= 0))
+        for i in changed.tolist():
+            bodies[i].color = PALETTE[indices[i]]
+        self._colors[changed] = PALETTE_RGB[indices[changed]]
+        self._color_indices = indices
+
     def draw(self):
         self.screen.fill((0, 0, 0))  # Fill the screen with black
-        for body in self.astronomical_bodies:
-            if body.get_type() == 'planet':
-                pygame.draw.circle(self.screen, (255, 255, 255), (body.center_x, body.center_y),
-                                   body.orbit_radius, 1)
-
-            pygame.draw.circle(self.screen, body.get_color(), (int(body.x), int(body.y)), body.radius)
+        self.update_colors()
+        bodies = self.astronomical_bodies
+        count = len(bodies)
+        for i in np.flatnonzero(self._color_kinds == 2).tolist():
+            if bodies[i].get_type() == 'planet':
+                pygame.draw.circle(self.screen, (255, 255, 255), (bodies[i].center_x, bodies[i].center_y),
+                                   bodies[i].orbit_radius, 1)
+
+        small = np.zeros(count, dtype=bool)
+        if self.lod_threshold is not None and count >= self.lod_threshold:
+            radii = np.fromiter((body.radius for body in bodies), dtype=np.float64, count=count)
+            small = radii <= self.lod_radius
+        for i in np.flatnonzero(~small).tolist():
+            body = bodies[i]
+            pygame.draw.circle(self.screen, body.color, (int(body.x), int(body.y)), body.radius)
+
+        if small.any():
+            xs = np.fromiter((body.x for body in bodies), dtype=np.float64, count=count)
+            ys = np.fromiter((body.y for body in bodies), dtype=np.float64, count=count)
+            splat_points(self.screen, xs[small], ys[small], self._colors[small])
 
     def run(self):
         self.init_pygame()
@@ -142,8 +592,7 @@ class Simulator:
                 if event.type == pygame.QUIT:
                     running = False
 
-            for body in self.astronomical_bodies:
-                body.move(self.time_step)
+            self.move_bodies()
 
             self.draw()
 
@@ -158,49 +607,155 @@ class Simulator:
         if self.save_gif:
             imageio.mimsave(self.gif_name, self.frames, fps=30, loop=0)
 
+        self.close()
         pygame.quit()
         sys.exit()
 
+    def close(self):
+        """
+        Release the gravity system of the bodies and its threads, it is rebuilt on the next move
+        """
+        if self._gravity is not None:
+            self._gravity.close()
+            self._gravity = None
 
-def compute_init_positions(screen_height: int, screen_width: int, solar_distances: list()) -> list[tuple]:
-    assert solar_distances != []
-    assert screen_height != 0
-    assert screen_width != 0
-
-    furthest_planet_distance = sum(solar_distances)
-    screen_size = min(screen_height, screen_width) // 2
-
-    scaling_factor = screen_size / furthest_planet_distance
-    screen_distances = [distance * scaling_factor for distance in solar_distances]
-    distance_to_sun_in_screen = 0
-    init_pos = []
-    for s_dist in screen_distances:
-        distance_to_sun_in_screen += s_dist
-        init_pos.append((distance_to_sun_in_screen + screen_width // 2, screen_height // 2))
+    def save_snapshot(self, path):
+        """
+        Save the bodies, the time step and the state of the random generator to a .npz file
+        """
+        arrays = pack_objects(self.astronomical_bodies)
+        arrays.update(random_state())
+        arrays['time_step'] = np.array(self.time_step)
+        arrays['simulation_time'] = np.array(self.simulation_time)
+        np.savez(path, **arrays)
 
-        assert distance_to_sun_in_screen <= screen_size
+    def restore_snapshot(self, path):
+        """
+        Replace the bodies, the time step and the state of the random generator with the saved ones
+        """
+        with np.load(path) as arrays:
+            self.astronomical_bodies = unpack_objects(arrays, {'Star': Star, 'Planet': Planet, 'Meteor': Meteor})
+            self._color_kinds = np.empty(0, dtype=np.int64)
+            self._orbits = None
+            self.close()
+            set_random_state(arrays)
+            self.time_step = float(arrays['time_step'])
+            if 'simulation_time' in arrays:
+                self.simulation_time = float(arrays['simulation_time'])
+
+
+# Columns of a scenario file and their types. kind, x, y and radius are required, the others have defaults
+SCENARIO_COLUMNS = {'id': np.int64, 'kind': 'U16', 'type': 'U16', 'x': np.float64, 'y': np.float64,
+                    'radius': np.float64, 'center_x': np.float64, 'center_y': np.float64,
+                    'orbit_radius': np.float64, 'angle_speed': np.float64, 'parent': np.int64,
+                    'speed': np.float64, 'max_distance': np.float64}
+# The class of every kind of body and the scenario columns that become its attributes
+SCENARIO_KINDS = {'Star': (Star, ('id', 'type', 'x', 'y', 'radius')),
+                  'Planet': (Planet, ('id', 'type', 'x', 'y', 'radius', 'center_x', 'center_y', 'orbit_radius',
+                                      'angle', 'angle_speed', 'parent')),
+                  'Meteor': (Meteor, ('id', 'type', 'x', 'y', 'radius', 'speed', 'max_distance', 'screen_width',
+                                      'screen_height', 'delta_x', 'delta_y', 'traveled_distance'))}
+
+
+def load_scenario(path):
+    """
+    Read a .json or .npz scenario as one array per column of SCENARIO_COLUMNS, filling in the missing
+    optional columns with whole-column operations: ids count from 0, the type is the lower-case kind,
+    orbits are centred on (center_x, center_y), which default to 0, and pass through (x, y), planets
+    have no parent, and speeds and distances default to 0
+    """
+    if path.endswith('.json'):
+        with open(path) as source:
+            raw = json.load(source)
+    else:
+        with np.load(path) as arrays:
+            raw = {name: arrays[name] for name in arrays.files}
+    unknown = set(raw) - set(SCENARIO_COLUMNS)
+    if unknown:
+        raise ValueError("Invalid scenario columns " + ", ".join(sorted(unknown)))
+    for name in ('kind', 'x', 'y', 'radius'):
+        if name not in raw:
+            raise ValueError("Missing scenario column " + name)
+    columns = {name: np.asarray(values, dtype=SCENARIO_COLUMNS[name]) for name, values in raw.items()}
+    count = len(columns['kind'])
+    if any(len(values) != count for values in columns.values()):
+        raise ValueError("Scenario columns of different lengths")
+    kinds, kind_rows = np.unique(columns['kind'], return_inverse=True)
+    invalid = set(kinds.tolist()) - set(SCENARIO_KINDS)
+    if invalid:
+        raise ValueError("Invalid body kinds " + ", ".join(sorted(invalid)))
+
+    columns.setdefault('id', np.arange(count, dtype=np.int64))
+    columns.setdefault('type', np.char.lower(kinds)[kind_rows])
+    for name in ('center_x', 'center_y', 'angle_speed', 'speed', 'max_distance'):
+        columns.setdefault(name, np.zeros(count))
+    columns.setdefault('parent', np.full(count, -1, dtype=np.int64))
+    if 'orbit_radius' not in columns:
+        columns['orbit_radius'] = np.hypot(columns['x'] - columns['center_x'], columns['y'] - columns['center_y'])
+    return columns
+
+
+def scenario_columns(bodies):
+    """
+    Return the scenario columns describing the given bodies, ready for save_scenario
+    """
+    columns = {name: [] for name in SCENARIO_COLUMNS}
+    for body in bodies:
+        state = vars(body)
+        columns['kind'].append(type(body).__name__)
+        for name in SCENARIO_COLUMNS:
+            if name != 'kind':
+                columns[name].append(state.get(name, -1 if name == 'parent' else 0))
+    return {name: np.asarray(values, dtype=SCENARIO_COLUMNS[name]) for name, values in columns.items()}
+
+
+def scenario_bodies(columns, screen_width, screen_height):
+    """
+    Build the bodies of a scenario in row order, one batch per kind: the columns are converted to Python
+    values once, the angles of the planets computed with one np.arctan2, and the bodies created without
+    calling __init__ and given their attributes as a whole dict. Meteors respawn inside the given screen
+    """
+    kinds = columns['kind']
+    count = len(kinds)
+    derived = {'angle': np.arctan2(columns['y'] - columns['center_y'], columns['x'] - columns['center_x']),
+               'screen_width': np.full(count, screen_width), 'screen_height': np.full(count, screen_height),
+               'delta_x': np.zeros(count), 'delta_y': np.zeros(count), 'traveled_distance': np.zeros(count)}
+    bodies = np.empty(count, dtype=object)
+    for kind, (cls, names) in SCENARIO_KINDS.items():
+        rows = np.flatnonzero(kinds == kind)
+        if len(rows) == 0:
+            continue
+        values = [(columns[name] if name in columns else derived[name])[rows].tolist() for name in names]
+        values.append([WHITE] * len(rows))
+        keys = names + ('color',)
+        objects = []
+        for row in zip(*values):
+            body = cls.__new__(cls)
+            body.__dict__ = dict(zip(keys, row))
+            objects.append(body)
+        bodies[rows] = objects
+    return bodies.tolist()
 
-    return init_pos
 
+def compute_init_positions(screen_height: int, screen_width: int, solar_distances: list()) -> list[tuple]:
+    init_pos = compute_init_positions_batch(screen_height, screen_width, [solar_distances])
+    return [(distance, screen_height // 2) for distance in init_pos[:, 0].tolist()]
 
-if __name__ == "__main__":
-    x = 80
-    screen_width = 16 * x
-    screen_height = 9 * x
 
+def build_solar_system(screen_width: int, screen_height: int, size_divider: float = 1.3,
+                       speed_multiplier: float = 50, meteor_count: int = 10, moons_per_planet: int = 0) -> list:
+    """
+    Return the sun, the eight planets, moons_per_planet moons around every planet and meteor_count
+    meteors of the example scene
+    """
     screen_center_x = screen_width // 2
     screen_center_y = screen_height // 2
 
     astronomical_objects = []
-    time_step = 0.05
-    save_gif = True
-    gif_name = 'animation.gif'
 
     solar_distances = [31, 31, 31, 31, 62, 31, 31, 31]
     init_positions = compute_init_positions(screen_height, screen_width, solar_distances)
 
-    size_divider = 1.3
-
     sun = Star(0, screen_center_x, screen_center_y, 30 // size_divider, 'star')
     astronomical_objects.append(sun)
 
@@ -215,8 +770,6 @@ if __name__ == "__main__":
         (7, 0.002, 8)  # Neptune
     ]
 
-    speed_multiplier = 50
-
     for i, (planet_id, angle_speed, radius) in enumerate(planet_params):
         init_pos = init_positions[i]
         planet = Planet(
@@ -232,12 +785,80 @@ if __name__ == "__main__":
         )
         astronomical_objects.append(planet)
 
+    # Add moons, orbiting their planet at increasing distances. Their ids are past the planet colors.
+    moon_id = len(PLANET_COLORS)
+    for parent in range(1, len(planet_params) + 1):
+        planet = astronomical_objects[parent]
+        for j in range(moons_per_planet):
+            orbit_radius = planet.radius + 3 + 2 * j
+            moon = Planet(moon_id, planet.x + orbit_radius, planet.y, 1, 'moon', planet.x, planet.y,
+                          orbit_radius, 0.05 * speed_multiplier / (j + 1), parent)
+            astronomical_objects.append(moon)
+            moon_id += 1
+
     # Add meteors
-    for id in range(0, 10):
+    for id in range(0, meteor_count):
         meteor = Meteor(id, random.uniform(0, screen_width),
                         random.uniform(0, screen_height),
-                        2, 'Meteor', random.uniform(20, 60), random.uniform(500, 1000))
+                        2, 'Meteor', random.uniform(20, 60), random.uniform(500, 1000), screen_width, screen_height)
         astronomical_objects.append(meteor)
 
+    return astronomical_objects
+
+
+# Keys of a sweep job and their default values
+SWEEP_DEFAULTS = {'screen_width': 16 * 80, 'screen_height': 9 * 80, 'time_step': 0.05,
+                  'size_divider': 1.3, 'speed_multiplier': 50, 'meteor_count': 10, 'moons_per_planet': 0,
+                  'gravity': None, 'gravitational_constant': 1.0, 'theta': 0.5}
+
+
+def _sweep_job(job, params, seed, steps):
+    """
+    Worker of run_sweep, run one headless simulation of the solar system and return its summary, with
+    the keys of params taken from SWEEP_DEFAULTS. Run a sweep over 1000 steps with
+    run_sweep(_sweep_job, grid, path, 1000)
+    """
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    start = time.perf_counter()
+    options = dict(SWEEP_DEFAULTS, **params)
+    screen_width = options['screen_width']
+    screen_height = options['screen_height']
+    bodies = build_solar_system(screen_width, screen_height, options['size_divider'],
+                                options['speed_multiplier'], options['meteor_count'], options['moons_per_planet'])
+    simulator = Simulator(screen_width, screen_height, options['time_step'], bodies, gravity=options['gravity'],
+                          gravitational_constant=options['gravitational_constant'], theta=options['theta'])
+    timings = {'setup': time.perf_counter() - start, 'move': 0.0, 'colors': 0.0}
+    try:
+        for _ in range(steps):
+            moving = time.perf_counter()
+            simulator.move_bodies()
+            coloring = time.perf_counter()
+            simulator.update_colors()
+            timings['move'] += coloring - moving
+            timings['colors'] += time.perf_counter() - coloring
+    finally:
+        simulator.close()
+    timings['total'] = time.perf_counter() - start
+    return {'job': job, 'params': params, 'seed': seed, 'steps': steps,
+            'positions': [[body.x, body.y] for body in simulator.astronomical_bodies],
+            'types': [body.get_type() for body in simulator.astronomical_bodies],
+            'timings': timings}
+
+
+if __name__ == "__main__":
+    x = 80
+    screen_width = 16 * x
+    screen_height = 9 * x
+
+    time_step = 0.05
+    save_gif = True
+    gif_name = 'animation.gif'
+
+    size_divider = 1.3
+    speed_multiplier = 50
+
+    astronomical_objects = build_solar_system(screen_width, screen_height, size_divider, speed_multiplier)
+
     simulator = Simulator(screen_width, screen_height, time_step, astronomical_objects, save_gif, gif_name)
     simulator.run()
@@ -2,8 +2,100 @@ import numpy as np
 import pygame
 import sys
 import math
+import asyncio
+import functools
+import heapq
+import time
 import random
 import imageio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# The helpers shared by the Section 2 simulators live in Section2/Implementation
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from simulation_helpers import (pack_objects, unpack_objects, random_state, set_random_state, run_sweep, splat_points,
+                                save_scenario)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Telemetry falls back to compressed .npz shards
+    pa = None
+    pq = None
+
+# Palette registry, built once at import time, and the index of each of its colors
+PALETTE = (
+    (255, 255, 255),  # White, the default color
+    (255, 165, 0),  # Orange
+    (0, 0, 255),  # Blue
+    (255, 0, 0),  # Red
+    (0, 255, 0),  # Green
+)
+WHITE, ORANGE, BLUE, RED, GREEN = range(len(PALETTE))
+PALETTE_RGB = np.array(PALETTE, dtype=np.float32)  # The palette as an (n, 3) array, indexed by palette index
+
+# Seconds between two checks of the window events while run_async is paused
+PAUSE_POLL_INTERVAL = 0.05
+
+# Two particles are in contact once their centres are closer than this factor times the sum of their radii
+CONTACT_MARGIN = 1.2
+
+
+def _overlapping_extents(lower, upper):
+    """
+    Sort-and-sweep over intervals [lower, upper) whose lower ends are sorted. Yields the overlapping
+    pairs as two arrays of indices, one numpy pass per offset in sorted order, for as long as any
+    interval still overlaps the one offset places further. The cost is O(n) memory and O(n) work per
+    pass, and the number of passes is the largest number of intervals overlapping one interval.
+    """
+    active = np.arange(len(lower))
+    offset = 1
+    while True:
+        # The lower ends are sorted, so an interval that ends before its partner starts is done
+        active = active[active + offset < len(lower)]
+        active = active[lower[active + offset] < upper[active]]
+        if len(active) == 0:
+            return
+        yield active, active + offset
+        offset += 1
+
+
+def _strip_contacts(shm_name, capacity, count, x_start, x_end, halo):
+    """
+    Worker of the parallel collision mode. Reads the x, y and radius columns from shared memory and
+    flags the particles whose centre lies in [x_start, x_end) and that touch any particle, looking at
+    the particles within the halo around the strip. Like the serial 'sweep' broad phase, the strip is
+    sorted by the left end of the x-extents and swept with _overlapping_extents, so a strip of k
+    particles costs O(k log k) plus the number of overlapping x-extents. Every strip writes only the
+    flags it owns.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray((4, capacity), dtype=np.float64, buffer=shm.buf)
+        x, y, radius = data[0, :count], data[1, :count], data[2, :count]
+        nearby = np.nonzero((x >= x_start - halo) & (x < x_end + halo))[0]
+        lower = x[nearby] - radius[nearby] * CONTACT_MARGIN
+        order = nearby[np.argsort(lower, kind='stable')]
+        xs, ys, radii = x[order], y[order], radius[order]
+        lower = xs - radii * CONTACT_MARGIN
+        upper = xs + radii * CONTACT_MARGIN
+        contact = np.zeros(len(order), dtype=bool)
+        for active, partner in _overlapping_extents(lower, upper):
+            distance = np.hypot(xs[active] - xs[partner], ys[active] - ys[partner])
+            threshold = (radii[active] + radii[partner]) * CONTACT_MARGIN
+            touching = distance < threshold
+            # np.hypot may round differently from math.hypot, re-check the borderline pairs serially
+            for i in np.nonzero(np.abs(distance - threshold) <= 1e-9 * threshold)[0]:
+                p, q = order[active[i]], order[partner[i]]
+                touching[i] = math.hypot(x[p] - x[q], y[p] - y[q]) < threshold[i]
+            contact[active[touching]] = True
+            contact[partner[touching]] = True
+        owned = (xs >= x_start) & (xs < x_end)
+        data[3, order[owned]] = contact[owned]
+    finally:
+        shm.close()
 
 
 class Particle:
@@ -27,7 +119,7 @@ class Particle:
         self.x = x
         self.y = y
         self.radius = radius
-        self.color = (255, 255, 255)  # Default white color
+        self.color = PALETTE[WHITE]  # Default white color
         self.shape = shape  # 'circle' or 'square'
 
     def move(self):
@@ -67,9 +159,9 @@ class LinearParticle(Particle):
 
     def update_color(self, width, height):
         if self.x < width // 2:
-            self.color = (255, 165, 0)  # Orange
+            self.color = PALETTE[ORANGE]
         else:
-            self.color = (0, 0, 255)  # Blue
+            self.color = PALETTE[BLUE]
 
     def collision_behaviour(self):
         # Collision detected
@@ -111,9 +203,9 @@ class CircularParticle(Particle):
 
     def update_color(self, width, height):
         if self.y < height // 2:
-            self.color = (255, 0, 0)  # Red
+            self.color = PALETTE[RED]
         else:
-            self.color = (0, 255, 0)  # Green
+            self.color = PALETTE[GREEN]
 
     def collision_behaviour(self):
         self.angle_speed = -self.angle_speed
@@ -122,6 +214,594 @@ class CircularParticle(Particle):
         return self.angle_speed * self.orbit_radius
 
 
+class _QuadNode:
+    """
+    A node of the QuadTree covering the region [x0, x1) x [y0, y1).
+    Leaves store particles, inner nodes store four children.
+    """
+
+    def __init__(self, x0, y0, x1, y1, depth):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.depth = depth
+        self.particles = []
+        self.children = None
+
+    def contains(self, x, y):
+        return self.x0 <= x < self.x1 and self.y0 <= y < self.y1
+
+    def child_for(self, x, y):
+        mid_x = (self.x0 + self.x1) / 2
+        mid_y = (self.y0 + self.y1) / 2
+        return self.children[(x >= mid_x) + 2 * (y >= mid_y)]
+
+    def distance_to(self, x, y):
+        dx = max(self.x0 - x, 0, x - self.x1)
+        dy = max(self.y0 - y, 0, y - self.y1)
+        return math.hypot(dx, dy)
+
+
+class QuadTree:
+    """
+    A bucket point-region quadtree over the centres of the particles.
+
+    Particles of different radii are stored by their centre, and every query is widened by the
+    largest radius seen so far, so a particle is found whenever its body reaches the query region.
+
+    Attributes:
+        root (_QuadNode): The node covering the whole board.
+        capacity (int): The number of particles a leaf holds before it is split.
+        max_depth (int): The depth at which leaves stop splitting.
+        max_radius (float): The largest radius of an inserted particle.
+        outside (list): Particles whose centre lies outside the board.
+
+    Methods:
+        insert(particle): Adds a particle to the tree.
+        remove(particle): Removes a particle from the tree.
+        update(particle): Moves a particle to the right leaf after it moved.
+        query_rect(x0, y0, x1, y1): Returns the particles overlapping a rectangle.
+        query_radius(x, y, radius): Returns the particles overlapping a circle.
+        nearest(x, y): Returns the particle with the closest centre.
+    """
+
+    def __init__(self, width, height, capacity=8, max_depth=12):
+        self.root = _QuadNode(0, 0, width, height, 0)
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.max_radius = 0
+        self.outside = []
+        self._leaf_of = {}  # particle id -> leaf holding the particle, None when outside the board
+
+    def __len__(self):
+        return len(self._leaf_of)
+
+    def insert(self, particle):
+        self.max_radius = max(self.max_radius, particle.radius)
+        if not self.root.contains(particle.x, particle.y):
+            self.outside.append(particle)
+            self._leaf_of[particle.id] = None
+            return
+        node = self.root
+        while node.children is not None:
+            node = node.child_for(particle.x, particle.y)
+        node.particles.append(particle)
+        self._leaf_of[particle.id] = node
+        if len(node.particles) > self.capacity and node.depth < self.max_depth:
+            self._split(node)
+
+    def _split(self, node):
+        mid_x = (node.x0 + node.x1) / 2
+        mid_y = (node.y0 + node.y1) / 2
+        depth = node.depth + 1
+        node.children = [_QuadNode(node.x0, node.y0, mid_x, mid_y, depth),
+                         _QuadNode(mid_x, node.y0, node.x1, mid_y, depth),
+                         _QuadNode(node.x0, mid_y, mid_x, node.y1, depth),
+                         _QuadNode(mid_x, mid_y, node.x1, node.y1, depth)]
+        particles = node.particles
+        node.particles = []
+        for particle in particles:
+            child = node.child_for(particle.x, particle.y)
+            child.particles.append(particle)
+            self._leaf_of[particle.id] = child
+        for child in node.children:
+            if len(child.particles) > self.capacity and child.depth < self.max_depth:
+                self._split(child)
+
+    def remove(self, particle):
+        node = self._leaf_of.pop(particle.id)
+        if node is None:
+            self.outside.remove(particle)
+        else:
+            node.particles.remove(particle)
+
+    def update(self, particle):
+        """
+        Re-files a particle after it moved. Particles that stay inside their leaf cost a single bounds check.
+        """
+        node = self._leaf_of[particle.id]
+        if node is not None and node.contains(particle.x, particle.y):
+            return
+        self.remove(particle)
+        self.insert(particle)
+
+    def query_rect(self, x0, y0, x1, y1):
+        """
+        Returns the particles whose body overlaps the rectangle [x0, x1] x [y0, y1].
+        """
+        found = [particle for particle in self.outside if self._overlaps_rect(particle, x0, y0, x1, y1)]
+        margin = self.max_radius
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.x0 > x1 + margin or node.x1 < x0 - margin or node.y0 > y1 + margin or node.y1 < y0 - margin:
+                continue
+            if node.children is not None:
+                stack.extend(node.children)
+            else:
+                found.extend(particle for particle in node.particles
+                             if self._overlaps_rect(particle, x0, y0, x1, y1))
+        return found
+
+    @staticmethod
+    def _overlaps_rect(particle, x0, y0, x1, y1):
+        dx = max(x0 - particle.x, 0, particle.x - x1)
+        dy = max(y0 - particle.y, 0, particle.y - y1)
+        return math.hypot(dx, dy) <= particle.radius
+
+    def query_radius(self, x, y, radius):
+        """
+        Returns the particles whose body overlaps the circle of the given radius around (x, y).
+        """
+        found = [particle for particle in self.outside
+                 if math.hypot(particle.x - x, particle.y - y) <= radius + particle.radius]
+        reach = radius + self.max_radius
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.distance_to(x, y) > reach:
+                continue
+            if node.children is not None:
+                stack.extend(node.children)
+            else:
+                found.extend(particle for particle in node.particles
+                             if math.hypot(particle.x - x, particle.y - y) <= radius + particle.radius)
+        return found
+
+    def nearest(self, x, y, exclude=None):
+        """
+        Returns the particle whose centre is closest to (x, y), or None if the tree is empty.
+        Parameters:
+            exclude (Particle): A particle to skip, e.g. when looking for the neighbour of a particle.
+        """
+        best = None
+        best_distance = math.inf
+        for particle in self.outside:
+            distance = math.hypot(particle.x - x, particle.y - y)
+            if particle is not exclude and distance < best_distance:
+                best, best_distance = particle, distance
+        heap = [(self.root.distance_to(x, y), 0, self.root)]
+        seq = 1
+        while heap:
+            node_distance, _, node = heapq.heappop(heap)
+            if node_distance >= best_distance:
+                break  # Every remaining node is further than the best particle
+            if node.children is None:
+                for particle in node.particles:
+                    distance = math.hypot(particle.x - x, particle.y - y)
+                    if particle is not exclude and distance < best_distance:
+                        best, best_distance = particle, distance
+            else:
+                for child in node.children:
+                    heapq.heappush(heap, (child.distance_to(x, y), seq, child))
+                    seq += 1
+        return best
+
+
+class AdaptiveTimeStep:
+    """
+    Chooses every time step of a Simulator from how soon the sampled particles can come into contact
+    with each other or reach a wall: the step is safety times the smallest gap divided by the closing
+    speed (the sum of the two speeds), clamped between min_step and max_step. Particles far apart get long
+    steps and particles about to touch get short ones, so contacts are sampled as finely as with a small
+    fixed step while sparse scenes need many fewer steps. Contacts already made are left to
+    check_collisions and do not limit the step.
+    Only the pairs whose x-extents, grown by the distance they could travel within the longest
+    useful step, overlap are looked at, found by sorting and sweeping along x, so the cost grows
+    with the number of close pairs rather than n^2 and the memory is O(n).
+
+    Attributes:
+        min_step (float): The shortest step, used when a contact is imminent.
+        max_step (float): The longest step, used when nothing is close.
+        safety (float): The fraction of the time to the closest contact covered by one step.
+        history (list): The (simulation time, step) of every step chosen so far.
+
+    Methods:
+        choose(simulator, particles): Returns the next time step.
+    """
+
+    def __init__(self, min_step, max_step, safety=0.25):
+        if not 0 < min_step <= max_step or not 0 < safety <= 1:
+            raise ValueError("Invalid adaptive time step bounds")
+        self.min_step = min_step
+        self.max_step = max_step
+        self.safety = safety
+        self.history = []
+
+    def choose(self, simulator, particles):
+        """
+        Returns the next time step of the simulator and appends it to the history.
+        Parameters:
+            simulator (Simulator): The simulator whose board bounds the particles.
+            particles (list): The particles moved by sampling, the ones whose contacts are checked.
+        """
+        count = len(particles)
+        x = np.fromiter((particle.x for particle in particles), dtype=np.float64, count=count)
+        y = np.fromiter((particle.y for particle in particles), dtype=np.float64, count=count)
+        radius = np.fromiter((particle.radius for particle in particles), dtype=np.float64, count=count)
+        speed = np.fromiter((abs(particle.speed()) for particle in particles), dtype=np.float64, count=count)
+
+        # Contacts further away in time than this do not limit the step
+        time_to_contact = self.max_step / self.safety
+        wall_gap = np.minimum.reduce([x - radius, simulator.width - x - radius,
+                                      y - radius, simulator.height - y - radius])
+        approaching = (wall_gap > 0) & (speed > 0)
+        if approaching.any():
+            time_to_contact = min(time_to_contact, np.min(wall_gap[approaching] / speed[approaching]))
+
+        # Two particles can only touch within time_to_contact if the x-extents they could sweep meanwhile
+        # overlap, so only those pairs are looked at
+        reach = radius * CONTACT_MARGIN + speed * time_to_contact
+        order = np.argsort(x - reach, kind='stable')
+        x, y, radius, speed, reach = x[order], y[order], radius[order], speed[order], reach[order]
+        for active, partner in _overlapping_extents(x - reach, x + reach):
+            gap = (np.hypot(x[active] - x[partner], y[active] - y[partner])
+                   - CONTACT_MARGIN * (radius[active] + radius[partner]))
+            closing_speed = speed[active] + speed[partner]
+            approaching = (gap > 0) & (closing_speed > 0)
+            if approaching.any():
+                time_to_contact = min(time_to_contact, np.min(gap[approaching] / closing_speed[approaching]))
+        step = float(min(max(self.safety * time_to_contact, self.min_step), self.max_step))
+        self.history.append((simulator.simulation_time, step))
+        return step
+
+
+def trajectory_dtype(count):
+    """
+    Returns the layout of one recorded frame of count particles.
+    """
+    return np.dtype([('x', np.float32, (count,)),
+                     ('y', np.float32, (count,)),
+                     ('color', np.uint8, (count, 3)),
+                     ('state', np.uint8, (count,))])
+
+
+class TrajectoryRecorder:
+    """
+    Records the particles of every step into a memory-mapped file, one fixed-size row per frame.
+    The file is preallocated chunk_frames rows at a time, so recording never holds more than the
+    current page in memory. The radius and shape of the particles, which never change, and the
+    number of recorded frames are written next to it in path + '.meta.npz' by close().
+
+    Attributes:
+        path (str): The file holding the frames.
+        count (int): The number of particles per frame.
+        chunk_frames (int): The number of frames the file grows by when it is full.
+        frames (int): The number of frames recorded so far.
+
+    Methods:
+        record(particles, collisions): Appends one frame.
+        close(): Trims the file to the recorded frames and writes the metadata.
+    """
+
+    # Bits of the state column
+    COLLIDED = 1
+
+    def __init__(self, path, particles, chunk_frames=1024):
+        self.path = path
+        self.count = len(particles)
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self._radius = np.array([particle.radius for particle in particles])
+        self._shape = np.array([particle.shape for particle in particles])
+        self._dtype = trajectory_dtype(self.count)
+        self._capacity = chunk_frames
+        self._data = np.memmap(path, dtype=self._dtype, mode='w+', shape=(self._capacity,))
+
+    def _grow(self):
+        self._data.flush()
+        del self._data
+        self._capacity += self.chunk_frames
+        with open(self.path, 'r+b') as file:
+            file.truncate(self._capacity * self._dtype.itemsize)
+        self._data = np.memmap(self.path, dtype=self._dtype, mode='r+', shape=(self._capacity,))
+
+    def record(self, particles, collisions=None):
+        """
+        Appends the state of the particles as the next frame.
+        Parameters:
+            particles (list): The particles, in the same order as when the recorder was created.
+            collisions (list): A collision flag per particle id, as returned by check_collisions.
+        """
+        if self.frames == self._capacity:
+            self._grow()
+        frame = self.frames
+        self._data['x'][frame] = [particle.x for particle in particles]
+        self._data['y'][frame] = [particle.y for particle in particles]
+        self._data['color'][frame] = [particle.color for particle in particles]
+        if collisions is None:
+            self._data['state'][frame] = 0
+        else:
+            self._data['state'][frame] = [self.COLLIDED if collisions[particle.id] else 0
+                                          for particle in particles]
+        self.frames += 1
+
+    def close(self):
+        if self._data is None:
+            return  # Already closed
+        self._data.flush()
+        self._data = None
+        with open(self.path, 'r+b') as file:
+            file.truncate(self.frames * self._dtype.itemsize)
+        np.savez(self.path + '.meta.npz', count=self.count, frames=self.frames,
+                 radius=self._radius, shape=self._shape)
+
+
+class TrajectoryReplay:
+    """
+    Reads a recording made by TrajectoryRecorder. The frames stay on disk and are paged in only when
+    they are seeked to, so any frame of a very long recording can be shown immediately.
+
+    Attributes:
+        count (int): The number of particles per frame.
+        frames (int): The number of recorded frames.
+
+    Methods:
+        particles(): Creates particles matching the recorded radii and shapes.
+        apply(particles, frame): Moves the particles to a recorded frame.
+    """
+
+    def __init__(self, path):
+        with np.load(path + '.meta.npz') as meta:
+            self.count = int(meta['count'])
+            self.frames = int(meta['frames'])
+            self._radius = meta['radius'].tolist()
+            self._shape = meta['shape'].tolist()
+        if self.frames == 0:
+            self._data = np.empty(0, dtype=trajectory_dtype(self.count))  # An empty file cannot be mapped
+        else:
+            self._data = np.memmap(path, dtype=trajectory_dtype(self.count), mode='r', shape=(self.frames,))
+
+    def __len__(self):
+        return self.frames
+
+    def particles(self):
+        return [Particle(i, 0, 0, radius, shape) for i, (radius, shape) in enumerate(zip(self._radius, self._shape))]
+
+    def apply(self, particles, frame):
+        """
+        Sets the position and color of the particles to the ones of the given frame.
+        Returns:
+            numpy.ndarray: The state column of the frame.
+        """
+        row = self._data[frame]
+        for particle, x, y, color in zip(particles, row['x'].tolist(), row['y'].tolist(), row['color'].tolist()):
+            particle.x = x
+            particle.y = y
+            particle.color = tuple(color)
+        return row['state']
+
+
+class TelemetrySink:
+    """
+    Buffers the state of the particles of every frame into fixed-size column batches and writes each
+    full batch as a shard in a directory: a Parquet file when pyarrow is installed, a compressed .npz
+    file otherwise. Memory use is bounded by batch_rows, and both formats store each column separately
+    so load_telemetry can read just the columns it needs.
+
+    Attributes:
+        directory (str): The directory receiving the shards.
+        batch_rows (int): The number of rows buffered before a shard is written.
+        format (str): 'parquet' or 'npz'.
+        shards (int): The number of shards written so far.
+
+    Methods:
+        record(frame, particles, collisions): Buffers one row per particle.
+        flush(): Writes the buffered rows as a shard.
+        close(): Writes the remaining rows.
+    """
+
+    COLUMNS = ('frame', 'id', 'type', 'x', 'y', 'speed', 'collided')
+
+    def __init__(self, directory, batch_rows=65536, format=None):
+        if format is None:
+            format = 'npz' if pq is None else 'parquet'
+        if format not in ('parquet', 'npz') or (format == 'parquet' and pq is None):
+            raise ValueError("Invalid telemetry format")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self.format = format
+        self.shards = 0
+        self._rows = 0
+        self._buffer = {'frame': np.empty(batch_rows, dtype=np.int64),
+                        'id': np.empty(batch_rows, dtype=np.int64),
+                        'type': np.empty(batch_rows, dtype='U16'),
+                        'x': np.empty(batch_rows, dtype=np.float64),
+                        'y': np.empty(batch_rows, dtype=np.float64),
+                        'speed': np.empty(batch_rows, dtype=np.float64),
+                        'collided': np.empty(batch_rows, dtype=bool)}
+
+    def record(self, frame, particles, collisions=None):
+        """
+        Buffers the state of the particles at the given frame, writing shards whenever the buffer fills.
+        Parameters:
+            frame (int): The frame number.
+            particles (list): The particles to record.
+            collisions (list): A collision flag per particle id, as returned by check_collisions.
+        """
+        columns = {'frame': np.full(len(particles), frame),
+                   'id': [particle.id for particle in particles],
+                   'type': [type(particle).__name__ for particle in particles],
+                   'x': [particle.x for particle in particles],
+                   'y': [particle.y for particle in particles],
+                   'speed': [particle.speed() for particle in particles],
+                   'collided': [bool(collisions[particle.id]) if collisions else False for particle in particles]}
+        start = 0
+        while start < len(particles):
+            count = min(len(particles) - start, self.batch_rows - self._rows)
+            for name, values in columns.items():
+                self._buffer[name][self._rows:self._rows + count] = values[start:start + count]
+            self._rows += count
+            start += count
+            if self._rows == self.batch_rows:
+                self.flush()
+
+    def flush(self):
+        if self._rows == 0:
+            return
+        batch = {name: column[:self._rows] for name, column in self._buffer.items()}
+        path = os.path.join(self.directory, 'telemetry-{:05d}.{}'.format(self.shards, self.format))
+        if self.format == 'parquet':
+            pq.write_table(pa.table(batch), path)
+        else:
+            np.savez_compressed(path, **batch)
+        self.shards += 1
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_telemetry(directory, columns=None, body_id=None):
+    """
+    Reads the shards written by a TelemetrySink, loading only the requested columns.
+    Parameters:
+        directory (str): The directory holding the shards.
+        columns (list): The columns to load, defaults to all of them.
+        body_id (int): When given, only the rows of this particle are returned.
+    Returns:
+        dict: A NumPy array per column.
+    """
+    if columns is None:
+        columns = TelemetrySink.COLUMNS
+    needed = list(columns) if body_id is None or 'id' in columns else list(columns) + ['id']
+    parts = {name: [] for name in columns}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith('.parquet'):
+            if pq is None:
+                raise ValueError("pyarrow is needed to read " + name)
+            filters = None if body_id is None else [('id', '=', body_id)]
+            table = pq.read_table(path, columns=needed, filters=filters)
+            shard = {column: table.column(column).to_numpy() for column in needed}
+        elif name.endswith('.npz'):
+            with np.load(path) as arrays:
+                shard = {column: arrays[column] for column in needed}  # Only these members are decompressed
+            if body_id is not None:
+                rows = shard['id'] == body_id
+                shard = {column: values[rows] for column, values in shard.items()}
+        else:
+            continue
+        for column in columns:
+            parts[column].append(shard[column])
+    return {column: np.concatenate(values) if values else np.empty(0) for column, values in parts.items()}
+
+
+# Columns of a scenario file and their types. kind, x, y and radius are required, the others have defaults
+SCENARIO_COLUMNS = {'id': np.int64, 'kind': 'U16', 'x': np.float64, 'y': np.float64, 'radius': np.int64,
+                    'shape': 'U8', 'speed_x': np.float64, 'speed_y': np.float64, 'center_x': np.float64,
+                    'center_y': np.float64, 'orbit_radius': np.float64, 'angle': np.float64,
+                    'angle_speed': np.float64}
+# The class of every kind of particle and the scenario columns that become its attributes
+SCENARIO_KINDS = {'LinearParticle': (LinearParticle, ('id', 'x', 'y', 'radius', 'shape', 'speed_x', 'speed_y')),
+                  'CircularParticle': (CircularParticle, ('id', 'x', 'y', 'radius', 'shape', 'center_x', 'center_y',
+                                                          'orbit_radius', 'angle', 'angle_speed'))}
+
+
+def load_scenario(path):
+    """
+    Reads a scenario written by save_scenario, or by hand, as one NumPy array per column. The missing
+    optional columns are filled in with whole-column operations: ids count from 0, particles are
+    circles at rest, and orbits are centred on (center_x, center_y), which default to 0, and start at
+    (x, y): the orbit radius and angle default to the distance and direction of (x, y) from the centre.
+    Parameters:
+        path (str): A .json or .npz scenario file.
+    Returns:
+        dict: An array per column of SCENARIO_COLUMNS, all of the same length.
+    """
+    if path.endswith('.json'):
+        with open(path) as source:
+            raw = json.load(source)
+    else:
+        with np.load(path) as arrays:
+            raw = {name: arrays[name] for name in arrays.files}
+    unknown = set(raw) - set(SCENARIO_COLUMNS)
+    if unknown:
+        raise ValueError("Invalid scenario columns " + ", ".join(sorted(unknown)))
+    for name in ('kind', 'x', 'y', 'radius'):
+        if name not in raw:
+            raise ValueError("Missing scenario column " + name)
+    radius = np.asarray(raw['radius'], dtype=np.float64)
+    if np.any(radius != np.round(radius)):
+        raise ValueError("Particle radii must be integers")
+    columns = {name: np.asarray(values, dtype=SCENARIO_COLUMNS[name]) for name, values in raw.items()}
+    count = len(columns['kind'])
+    if any(len(values) != count for values in columns.values()):
+        raise ValueError("Scenario columns of different lengths")
+    invalid = set(np.unique(columns['kind']).tolist()) - set(SCENARIO_KINDS)
+    if invalid:
+        raise ValueError("Invalid particle kinds " + ", ".join(sorted(invalid)))
+
+    columns.setdefault('id', np.arange(count, dtype=np.int64))
+    columns.setdefault('shape', np.full(count, 'circle', dtype=SCENARIO_COLUMNS['shape']))
+    for name in ('speed_x', 'speed_y', 'center_x', 'center_y', 'angle_speed'):
+        columns.setdefault(name, np.zeros(count))
+    if 'orbit_radius' not in columns:
+        columns['orbit_radius'] = np.hypot(columns['x'] - columns['center_x'], columns['y'] - columns['center_y'])
+    if 'angle' not in columns:
+        columns['angle'] = np.arctan2(columns['y'] - columns['center_y'], columns['x'] - columns['center_x'])
+    return columns
+
+
+def scenario_columns(particles):
+    """
+    Returns the scenario columns describing the given particles, ready for save_scenario.
+    """
+    columns = {name: [] for name in SCENARIO_COLUMNS}
+    for particle in particles:
+        state = vars(particle)
+        columns['kind'].append(type(particle).__name__)
+        for name in SCENARIO_COLUMNS:
+            if name != 'kind':
+                columns[name].append(state.get(name, 0))
+    return {name: np.asarray(values, dtype=SCENARIO_COLUMNS[name]) for name, values in columns.items()}
+
+
+def scenario_particles(columns):
+    """
+    Builds the particles of a scenario, in row order, from the columns returned by load_scenario.
+    Each kind is built in one batch: its columns are converted to Python values once, and the
+    particles are created without calling __init__ and given their attributes as a whole dict.
+    """
+    kinds = columns['kind']
+    particles = np.empty(len(kinds), dtype=object)
+    for kind, (cls, names) in SCENARIO_KINDS.items():
+        rows = np.flatnonzero(kinds == kind)
+        if len(rows) == 0:
+            continue
+        values = [columns[name][rows].tolist() for name in names] + [[PALETTE[WHITE]] * len(rows)]
+        keys = names + ('color',)
+        objects = []
+        for row in zip(*values):
+            particle = cls.__new__(cls)
+            particle.__dict__ = dict(zip(keys, row))
+            objects.append(particle)
+        particles[rows] = objects
+    return particles.tolist()
+
+
 class Simulator:
     """
     A class to simulate the movement and interaction of particles.
@@ -131,22 +811,99 @@ class Simulator:
         height (int): The height of the simulation screen.
         particles (list): A list of particles in the simulation.
         contact_aware (bool): A flag to enable or disable collision detection.
+        event_driven (bool): A flag to resolve LinearParticle contacts by predicted time of impact.
+        event_time (float): The simulation time reached by the event-driven engine.
+        event_queue (list): A heap of predicted (time, seq, id1, id2, count1, count2) collision events.
+        event_collisions (int): The number of particle bounces resolved by the event queue so far.
+        broad_phase (str): How candidate pairs are found before the exact check ('brute', 'sweep' or 'quadtree').
+        quadtree (QuadTree): A spatial index of the particles, refreshed every frame.
+        selected (Particle): The particle last picked with the mouse, or None.
+        workers (int): The number of processes detecting contacts in vertical strips, 0 to stay serial.
+        physics_rate (float): Physics steps per second of wall time, or None for one step per frame.
+        render_rate (float): The maximum number of frames drawn per second.
+        max_substeps (int): The maximum number of physics steps run before a frame is drawn.
+        interpolate (bool): A flag to draw particles between the last two physics states.
+        collision_flags (list): The collision flag of every particle id during the last step.
+        recorder (TrajectoryRecorder): When set, every step is appended to this recording. Its frames have a
+            fixed width, so add_particle raises ValueError past the recorder's particle count.
+        telemetry (TelemetrySink): When set, the state of every step is sent to this sink.
+        steps (int): The number of steps run so far.
+        simulation_time (float): The sum of the time steps run so far.
+        step_controller (AdaptiveTimeStep): When set, chooses the time step before every step.
+        phase_times (dict): The seconds spent so far in each phase of step(): 'move', 'collisions',
+            'update' (spatial index and colors) and 'record'.
+        lod_threshold (int): The particle count from which small particles are splatted as points, None to never.
+        lod_radius (int): The largest radius of a particle drawn as a point.
         screen (pygame.Surface): The pygame screen object.
         clock (pygame.time.Clock): The pygame clock object.
 
     Methods:
         init_pygame(): Initializes pygame.
         add_particle(particle): Adds a particle to the simulation.
-        draw(): Draws the particles and simulation boundaries on the screen.
+        add_scenario(path): Adds the particles of a scenario file.
+        poisson_placement(count, radius): Generates separated positions for many particles at once.
+        update_index(): Re-files the moved particles in the quadtree.
+        particle_at(x, y): Returns the particle covering a point.
+        step(): Advances the simulation by one time step.
+        update_colors(): Updates the color of every particle in one batch.
+        draw(alpha): Draws the particles and simulation boundaries on the screen.
+        candidate_pairs(particles): Yields the pairs of particles that may be in contact.
+        parallel_contacts(particles): Finds the particles in contact using a process pool.
         check_collisions(): Checks and handles collisions between particles.
+        close(): Closes the recorder and the telemetry sink, and releases the process pool and its shared memory.
+        advance_events(duration): Advances the LinearParticles from collision event to collision event.
         run(): Runs the simulation loop.
+        run_async(steps, commands): Runs the simulation loop as a coroutine.
+        replay(path): Shows a recording made with a TrajectoryRecorder.
+        save_snapshot(path): Saves the state of the simulation to a .npz file.
+        restore_snapshot(path): Replaces the state of the simulation with a saved one.
     """
 
-    def __init__(self, width, height, time_step, gif_name, save_gif, contact_aware=False):
+    def __init__(self, width, height, time_step, gif_name, save_gif, contact_aware=False, event_driven=False,
+                 broad_phase='brute', workers=0, physics_rate=None, render_rate=60, max_substeps=8,
+                 interpolate=False, lod_threshold=None, lod_radius=2, step_controller=None):
+        if broad_phase not in ('brute', 'sweep', 'quadtree'):
+            raise ValueError("Invalid broad phase")
         self.width = width
         self.height = height
         self.particles = []
         self.contact_aware = contact_aware
+        self.event_driven = event_driven
+        self.event_time = 0.0
+        self.event_queue = []
+        self.event_collisions = 0
+        self._event_seq = 0
+        self._event_particles = {}  # id -> LinearParticle handled by the event queue
+        self._collision_counts = {}  # id -> number of collisions, used to discard stale events
+        self._synced_at = {}  # id -> event time at which the particle's x and y are valid
+        self._event_start = 0.0  # event time of the positions in the quadtree
+        self._event_end = 0.0  # event time up to which events are predicted
+        self._max_event_speed = 0.0  # speed of the fastest event particle, kept by its collisions
+        self.broad_phase = broad_phase
+        self._sweep_order = []  # particles sorted along x, kept between frames
+        self.quadtree = QuadTree(width, height)
+        self.workers = workers
+        self._pool = None
+        self._shared = None  # shared memory holding the x, y, radius and flag columns
+        self._shared_capacity = 0
+        self.physics_rate = physics_rate
+        self.render_rate = render_rate
+        self.max_substeps = max_substeps
+        self.interpolate = interpolate
+        self._previous_positions = np.empty((0, 2))  # (x, y) of every particle before the last physics step
+        self.collision_flags = []
+        self.recorder = None
+        self.telemetry = None
+        self.steps = 0
+        self.simulation_time = 0.0
+        self.step_controller = step_controller
+        self.phase_times = {'move': 0.0, 'collisions': 0.0, 'update': 0.0, 'record': 0.0}
+        self.lod_threshold = lod_threshold
+        self.lod_radius = lod_radius
+        self._color_kinds = np.empty(0, dtype=np.int64)  # 1 for linear, 2 for circular, 0 for other particles
+        self._color_indices = np.empty(0, dtype=np.int64)  # palette index of every particle
+        self._colors = np.empty((0, 3), dtype=np.float32)  # RGB of every particle, for splatting
+        self.selected = None
         self.time_step = time_step
         self.init_pygame()
         self.save_gif = save_gif
@@ -159,21 +916,141 @@ class Simulator:
         self.clock = pygame.time.Clock()
 
     def add_particle(self, particle):
+        if self.recorder is not None and len(self.particles) >= self.recorder.count:
+            raise ValueError("Cannot add particles past the count of the attached recorder")
         self.particles.append(particle)
+        self.quadtree.insert(particle)
+        if self.event_driven and isinstance(particle, LinearParticle):
+            self._register_event_particle(particle)
 
-    def random_placement(self, radius):
+    def random_placement(self, radius, avoid_overlap=False, attempts=100):
         """
         Generates a random position for a particle ensuring it stays within the screen bounds.
         Parameters:
             radius (int): The radius of the particle to ensure it doesn't spawn out of bounds.
+            avoid_overlap (bool): Whether to reject positions in contact with an existing particle.
+            attempts (int): The number of positions to try before giving up when avoiding overlaps.
         Returns:
             tuple: A tuple containing the x and y coordinates for the particle.
         """
-        x = random.randint(2 * radius, self.width - 2 * radius)
-        y = random.randint(2 * radius, self.height - 2 * radius)
-        assert radius <= x <= self.width - radius
-        assert radius <= y <= self.height - radius
-        return x, y
+        for _ in range(attempts):
+            x = random.randint(2 * radius, self.width - 2 * radius)
+            y = random.randint(2 * radius, self.height - 2 * radius)
+            assert radius <= x <= self.width - radius
+            assert radius <= y <= self.height - radius
+            if not avoid_overlap or not self._touches_particle(x, y, radius):
+                return x, y
+        raise ValueError("No free position for the particle")
+
+    def poisson_placement(self, count, radius, candidates=30):
+        """
+        Generates positions for count particles of the given radius that are not in contact with each
+        other nor with the particles already in the simulation, using Bridson's Poisson-disk sampling.
+        The board is filled at a spacing chosen from count, then count of the samples are kept, so the
+        particles are spread over the whole board in roughly O(count) time.
+        Parameters:
+            count (int): The number of positions to generate.
+            radius (int): The radius of the particles.
+            candidates (int): The number of candidates tried around a sample before it is retired.
+        Returns:
+            list: A list of (x, y) tuples.
+        """
+        if count <= 0:
+            return []
+        min_distance = CONTACT_MARGIN * 2 * radius
+        x0, y0 = 2 * radius, 2 * radius
+        area_width = self.width - 4 * radius
+        area_height = self.height - 4 * radius
+        # A saturated Poisson-disk set has about 0.64 * area / spacing ** 2 samples, aim a bit above count
+        spacing = max(min_distance, math.sqrt(0.55 * area_width * area_height / count))
+        while True:
+            points = self._bridson(x0, y0, area_width, area_height, spacing, radius, candidates)
+            if len(points) >= count:
+                return random.sample(points, count)
+            if spacing == min_distance:
+                raise ValueError("Only {} of {} particles fit on the board".format(len(points), count))
+            spacing = max(min_distance, spacing * 0.9)
+
+    def _bridson(self, x0, y0, area_width, area_height, spacing, radius, candidates):
+        # Background grid with at most one sample per cell, so each check looks at a 5x5 block of cells.
+        # The grid is padded by two cells on every side so the block never needs clamping.
+        cell = spacing / math.sqrt(2)
+        cols = int(area_width / cell) + 5
+        rows = int(area_height / cell) + 5
+        grid = [-1] * (cols * rows)
+        offsets = [r * cols + c for r in range(-2, 3) for c in range(-2, 3)]
+        spacing_squared = spacing * spacing
+        xs = []
+        ys = []
+        points = []
+        active = []
+        check_existing = len(self.quadtree) > 0
+
+        def fits(x, y):
+            if not (x0 <= x <= x0 + area_width and y0 <= y <= y0 + area_height):
+                return False
+            center = (int((y - y0) / cell) + 2) * cols + int((x - x0) / cell) + 2
+            for offset in offsets:
+                index = grid[center + offset]
+                if index >= 0:
+                    dx = xs[index] - x
+                    dy = ys[index] - y
+                    if dx * dx + dy * dy < spacing_squared:
+                        return False
+            return not (check_existing and self._touches_particle(x, y, radius))
+
+        def add(x, y):
+            grid[(int((y - y0) / cell) + 2) * cols + int((x - x0) / cell) + 2] = len(points)
+            active.append(len(points))
+            xs.append(x)
+            ys.append(y)
+            points.append((x, y))
+
+        for _ in range(candidates):
+            x = random.uniform(x0, x0 + area_width)
+            y = random.uniform(y0, y0 + area_height)
+            if fits(x, y):
+                add(x, y)
+                break
+
+        while active:
+            slot = random.randrange(len(active))
+            px = xs[active[slot]]
+            py = ys[active[slot]]
+            for _ in range(candidates):
+                angle = random.uniform(0, 2 * math.pi)
+                distance = random.uniform(spacing, 2 * spacing)
+                x = px + distance * math.cos(angle)
+                y = py + distance * math.sin(angle)
+                if fits(x, y):
+                    add(x, y)
+                    break
+            else:
+                # No room left around this sample, retire it
+                active[slot] = active[-1]
+                active.pop()
+        return points
+
+    def _touches_particle(self, x, y, radius):
+        reach = CONTACT_MARGIN * (radius + self.quadtree.max_radius)
+        for other in self.quadtree.query_radius(x, y, reach):
+            if math.hypot(other.x - x, other.y - y) < CONTACT_MARGIN * (radius + other.radius):
+                return True
+        return False
+
+    def update_index(self):
+        for particle in self.particles:
+            self.quadtree.update(particle)
+
+    def particle_at(self, x, y):
+        """
+        Returns the particle whose body covers the point (x, y), used for picking with the mouse.
+        When several particles overlap the point, the one with the closest centre is returned.
+        """
+        covering = self.quadtree.query_radius(x, y, 0)
+        if not covering:
+            return None
+        return min(covering, key=lambda particle: math.hypot(particle.x - x, particle.y - y))
 
     def in_board(self, particle):
         # Bounce off the edges
@@ -193,41 +1070,202 @@ class Simulator:
         if particle.y + particle.radius > self.height:
             particle.y = self.height - particle.radius
 
-    def draw(self):
+    def draw(self, alpha=None):
+        """
+        Draws the particles and simulation boundaries on the screen.
+        Parameters:
+            alpha (float): When given, particles are drawn this fraction of the way from their position
+                before the last physics step to their current position.
+        """
         self.screen.fill((0, 0, 0))  # Fill the screen with black
         pygame.draw.line(self.screen, (255, 255, 255), (self.width // 2, 0), (self.width // 2, self.height), 1)
         pygame.draw.line(self.screen, (255, 255, 255), (0, self.height // 2), (self.width, self.height // 2), 1)
 
-        for particle in self.particles:
+        particles = self.particles
+        count = len(particles)
+        xs = np.fromiter((particle.x for particle in particles), dtype=np.float64, count=count)
+        ys = np.fromiter((particle.y for particle in particles), dtype=np.float64, count=count)
+        if alpha is not None and len(self._previous_positions) == count:
+            previous_x, previous_y = self._previous_positions[:, 0], self._previous_positions[:, 1]
+            xs = previous_x + (xs - previous_x) * alpha
+            ys = previous_y + (ys - previous_y) * alpha
+        small = np.zeros(count, dtype=bool)
+        if self.lod_threshold is not None and count >= self.lod_threshold:
+            # With many particles, the small ones cover a pixel or two and are cheaper to splat as points
+            radii = np.fromiter((particle.radius for particle in particles), dtype=np.float64, count=count)
+            small = radii <= self.lod_radius
+        for i in np.flatnonzero(~small).tolist():
+            particle = particles[i]
+            x, y = xs[i], ys[i]
             if particle.shape == 'circle':
-                pygame.draw.circle(self.screen, particle.color, (int(particle.x), int(particle.y)), particle.radius)
+                pygame.draw.circle(self.screen, particle.color, (int(x), int(y)), particle.radius)
             elif particle.shape == 'square':
                 pygame.draw.rect(self.screen, particle.color,
-                                 (int(particle.x - particle.radius), int(particle.y - particle.radius),
+                                 (int(x - particle.radius), int(y - particle.radius),
                                   particle.radius * 2, particle.radius * 2))
             else:
                 raise ValueError("Invalid particle shape")
+        if small.any():
+            if len(self._colors) != count:  # Drawn before the first update_colors
+                self._colors = np.array([particle.color for particle in particles], dtype=np.float32)
+            splat_points(self.screen, xs[small], ys[small], self._colors[small])
 
-    def check_collisions(self):
-        particle_collides = list(len(self.particles) * [False])
-        # Collision between particles
-        for i, particle1 in enumerate(self.particles):
-            for j, particle2 in enumerate(self.particles):
+        if self.selected is not None:
+            pygame.draw.circle(self.screen, (255, 255, 255), (int(self.selected.x), int(self.selected.y)),
+                               self.selected.radius + 3, 1)
+
+    def _sweep_key(self, particle):
+        return particle.x - particle.radius * CONTACT_MARGIN
+
+    def _sweep_pairs(self, particles):
+        """
+        Sort-and-sweep along the x-axis. The particles stay sorted between frames and are re-sorted
+        with insertion sort, which is nearly linear because they only move a little per frame.
+        """
+        order = self._sweep_order
+        if len(order) != len(particles):
+            # Particles were added or the checked set changed, start again from a full sort
+            order = sorted(particles, key=self._sweep_key)
+            self._sweep_order = order
+        else:
+            for i in range(1, len(order)):
+                particle = order[i]
+                key = self._sweep_key(particle)
+                j = i - 1
+                while j >= 0 and self._sweep_key(order[j]) > key:
+                    order[j + 1] = order[j]
+                    j -= 1
+                order[j + 1] = particle
+
+        active = []
+        for particle in order:
+            lower = self._sweep_key(particle)
+            # Drop the particles whose x-extent ends before this one starts
+            active = [other for other in active if other.x + other.radius * CONTACT_MARGIN > lower]
+            for other in active:
+                yield other, particle
+            active.append(particle)
+
+    def _quadtree_pairs(self, particles):
+        self.update_index()
+        checked = {particle.id for particle in particles}
+        for particle in particles:
+            reach = CONTACT_MARGIN * (particle.radius + self.quadtree.max_radius)
+            for other in self.quadtree.query_radius(particle.x, particle.y, reach):
+                # Report each pair once, from the particle with the smaller id
+                if other.id > particle.id and other.id in checked:
+                    yield particle, other
+
+    def candidate_pairs(self, particles):
+        """
+        Yields every pair of particles whose contact still has to be checked exactly.
+        Parameters:
+            particles (list): The particles to pair up.
+        Returns:
+            generator: Pairs of particles, a superset of the pairs in contact.
+        """
+        if self.broad_phase == 'sweep':
+            yield from self._sweep_pairs(particles)
+            return
+        if self.broad_phase == 'quadtree':
+            yield from self._quadtree_pairs(particles)
+            return
+        for i, particle1 in enumerate(particles):
+            for j, particle2 in enumerate(particles):
                 if i >= j:
                     continue  # Avoid checking the same pair twice and self-collision
+                yield particle1, particle2
+
+    def parallel_contacts(self, particles):
+        """
+        Splits the board into one vertical strip per worker and detects the contacts of each strip in
+        a process pool. The particle columns are shared with the workers through shared memory, and
+        each strip also reads a halo of neighbours as wide as the largest possible contact distance,
+        so the result is the same as the serial check.
+        Parameters:
+            particles (list): The particles to check.
+        Returns:
+            list: The particles in contact with at least one other particle.
+        """
+        count = len(particles)
+        if count < 2:
+            return []
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        if count > self._shared_capacity:
+            if self._shared is not None:
+                self._shared.close()
+                self._shared.unlink()
+            self._shared_capacity = max(count, 2 * self._shared_capacity)
+            self._shared = shared_memory.SharedMemory(create=True, size=4 * self._shared_capacity * 8)
+        data = np.ndarray((4, self._shared_capacity), dtype=np.float64, buffer=self._shared.buf)
+        data[0, :count] = [particle.x for particle in particles]
+        data[1, :count] = [particle.y for particle in particles]
+        data[2, :count] = [particle.radius for particle in particles]
+        data[3, :count] = 0
+
+        halo = 2 * CONTACT_MARGIN * max(particle.radius for particle in particles)
+        edges = [self.width * i / self.workers for i in range(self.workers + 1)]
+        edges[0], edges[-1] = -math.inf, math.inf  # The outer strips also own particles off the board
+        jobs = [self._pool.submit(_strip_contacts, self._shared.name, self._shared_capacity, count,
+                                  edges[i], edges[i + 1], halo)
+                for i in range(self.workers)]
+        for job in jobs:
+            job.result()
+        flags = data[3, :count]
+        return [particle for particle, flag in zip(particles, flags) if flag]
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.telemetry is not None:
+            self.telemetry.close()  # Writes the rows of the last, partial batch
+            self.telemetry = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared.unlink()
+            self._shared = None
+            self._shared_capacity = 0
+
+    def check_collisions(self, particles=None):
+        """
+        Samples the overlap of every pair of particles once and applies the collision behaviour. In the
+        event-driven mode, the particles are also checked against the particles moved by the event queue.
+        Parameters:
+            particles (list): The particles to check, defaults to all the particles in the simulation.
+        Returns:
+            list: A flag per particle id telling whether the particle collided.
+        """
+        if particles is None:
+            particles = self.particles
+        particle_collides = list(len(self.particles) * [False])
+        if self.workers > 0:
+            for particle in self.parallel_contacts(particles):
+                particle_collides[particle.id] = True
+            pairs = ()
+        else:
+            pairs = self.candidate_pairs(particles)
+        # Collision between particles
+        for particle1, particle2 in pairs:
+            dx = particle1.x - particle2.x
+            dy = particle1.y - particle2.y
+            distance = math.hypot(dx, dy)
+            min_distance = particle1.radius + particle2.radius
 
-                dx = particle1.x - particle2.x
-                dy = particle1.y - particle2.y
-                distance = math.hypot(dx, dy)
-                min_distance = particle1.radius + particle2.radius
+            # Collision detected and being within board
+            if distance < min_distance * CONTACT_MARGIN:
+                particle_collides[particle1.id] = True
+                particle_collides[particle2.id] = True
 
-                # Collision detected and being within board
-                if distance < min_distance * 1.2:
-                    particle_collides[particle1.id] = True
-                    particle_collides[particle2.id] = True
+        if self._event_particles:
+            self._event_contacts(particles, particle_collides)
 
         # Collision with board
-        for i, particle in enumerate(self.particles):
+        for i, particle in enumerate(particles):
             if not self.in_board(particle):
                 self.move_in_board(particle)
                 particle_collides[particle.id] = True
@@ -236,78 +1274,565 @@ class Simulator:
                 particle.collision_behaviour()
                 particle.move(self.time_step)
 
+        return particle_collides
+
+    def _event_contacts(self, particles, particle_collides):
+        """
+        Flags the contacts between the sampled particles and the particles moved by the event queue,
+        which the queue does not predict. The event particles are looked up in the quadtree, which holds
+        their positions of the start of the step, so the reach also covers how far they moved since.
+        An event particle in contact bounces, and its pending events become stale.
+        """
+        drift = self._max_event_speed * self.time_step
+        for particle in particles:
+            if particle.id in self._event_particles:
+                continue
+            reach = CONTACT_MARGIN * (particle.radius + self.quadtree.max_radius) + drift
+            for other in self.quadtree.query_radius(particle.x, particle.y, reach):
+                if other.id not in self._event_particles:
+                    continue
+                distance = math.hypot(particle.x - other.x, particle.y - other.y)
+                if distance < (particle.radius + other.radius) * CONTACT_MARGIN:
+                    particle_collides[particle.id] = True
+                    if not particle_collides[other.id]:
+                        particle_collides[other.id] = True
+                        other.collision_behaviour()
+                        self._collision_counts[other.id] += 1
+
+    def _register_event_particle(self, particle):
+        # Its events are predicted at the start of the next step, with the others
+        self._event_particles[particle.id] = particle
+        self._collision_counts[particle.id] = 0
+        self._synced_at[particle.id] = self.event_time
+
+    def _sync_particle(self, particle):
+        """
+        Moves a LinearParticle forward to the current event time. Between events the particles
+        travel in straight lines, so only the particles involved in an event need to be moved.
+        """
+        elapsed = self.event_time - self._synced_at[particle.id]
+        if elapsed > 0:
+            particle.move(elapsed)
+        self._synced_at[particle.id] = self.event_time
+
+    def time_to_hit(self, particle1, particle2):
+        """
+        Computes when two LinearParticles come into contact, assuming both are synced to the event time.
+        Parameters:
+            particle1 (LinearParticle): The first particle.
+            particle2 (LinearParticle): The second particle.
+        Returns:
+            float: The time until contact, or None if the particles never touch.
+        """
+        dx = particle2.x - particle1.x
+        dy = particle2.y - particle1.y
+        dvx = particle2.speed_x - particle1.speed_x
+        dvy = particle2.speed_y - particle1.speed_y
+        dvdr = dx * dvx + dy * dvy
+        if dvdr >= 0:
+            return None  # The particles are moving apart
+        drdr = dx * dx + dy * dy
+        sigma = (particle1.radius + particle2.radius) * CONTACT_MARGIN
+        if drdr <= sigma * sigma:
+            return None  # Already touching, e.g. spawned overlapping, so let them separate
+        dvdv = dvx * dvx + dvy * dvy
+        discriminant = dvdr * dvdr - dvdv * (drdr - sigma * sigma)
+        if discriminant < 0:
+            return None  # The particles pass each other
+        return max(0.0, -(dvdr + math.sqrt(discriminant)) / dvdv)
+
+    def time_to_wall(self, particle):
+        """
+        Computes when a LinearParticle, synced to the event time, reaches the edge of the board.
+        Returns:
+            float: The time until the particle touches a wall, or None if it is not moving.
+        """
+        times = []
+        if particle.speed_x > 0:
+            times.append((self.width - particle.radius - particle.x) / particle.speed_x)
+        elif particle.speed_x < 0:
+            times.append((particle.radius - particle.x) / particle.speed_x)
+        if particle.speed_y > 0:
+            times.append((self.height - particle.radius - particle.y) / particle.speed_y)
+        elif particle.speed_y < 0:
+            times.append((particle.radius - particle.y) / particle.speed_y)
+        if not times:
+            return None
+        return max(0.0, min(times))
+
+    def _push_event(self, time, particle1, particle2=None):
+        id2 = -1 if particle2 is None else particle2.id
+        count2 = -1 if particle2 is None else self._collision_counts[particle2.id]
+        heapq.heappush(self.event_queue, (self.event_time + time, self._event_seq, particle1.id, id2,
+                                          self._collision_counts[particle1.id], count2))
+        self._event_seq += 1
+
+    def predict_events(self, particle):
+        """
+        Pushes the wall event and pair events of a LinearParticle that happen before the end of the
+        current step onto the event queue. The partners are looked up in the quadtree, which holds the
+        positions of the start of the step, within the distance both particles can travel during the
+        step, so each prediction costs O(log n) plus the number of particles nearby.
+        Parameters:
+            particle (LinearParticle): The particle to predict events for.
+        """
+        self._sync_particle(particle)
+        time = self.time_to_wall(particle)
+        if time is not None and self.event_time + time <= self._event_end:
+            self._push_event(time, particle)
+        reach = (CONTACT_MARGIN * (particle.radius + self.quadtree.max_radius)
+                 + 2 * self._max_event_speed * (self._event_end - self._event_start))
+        for other in self.quadtree.query_radius(particle.x, particle.y, reach):
+            if other is particle or other.id not in self._event_particles:
+                continue
+            self._sync_particle(other)
+            time = self.time_to_hit(particle, other)
+            if time is not None and self.event_time + time <= self._event_end:
+                self._push_event(time, particle, other)
+
+    def advance_events(self, duration):
+        """
+        Advances every LinearParticle by duration, jumping from one predicted collision to the next.
+        Events are discarded lazily when one of their particles collided after they were predicted,
+        so contacts are exact no matter how large the time step is. The queue only holds the events of
+        the current step and is predicted again at the start of every step.
+        Parameters:
+            duration (float): The amount of simulation time to advance.
+        """
+        end_time = self.event_time + duration
+        self.event_queue = []
+        self._event_start = self.event_time
+        self._event_end = end_time
+        # Collisions only flip the velocities, so the fastest particle stays as fast during the step
+        self._max_event_speed = max((particle.speed() for particle in self._event_particles.values()),
+                                    default=0.0)
+        for particle in self._event_particles.values():
+            self.predict_events(particle)
+        while self.event_queue and self.event_queue[0][0] <= end_time:
+            time, _, id1, id2, count1, count2 = heapq.heappop(self.event_queue)
+            if self._collision_counts.get(id1) != count1:
+                continue
+            if id2 >= 0 and self._collision_counts.get(id2) != count2:
+                continue
+
+            self.event_time = time
+            particle1 = self._event_particles[id1]
+            self._sync_particle(particle1)
+            particle1.collision_behaviour()
+            self._collision_counts[id1] += 1
+            self.event_collisions += 1
+            if id2 >= 0:
+                particle2 = self._event_particles[id2]
+                self._sync_particle(particle2)
+                particle2.collision_behaviour()
+                self._collision_counts[id2] += 1
+                self.event_collisions += 1
+                self.predict_events(particle1)
+                self.predict_events(particle2)
+            else:
+                self.move_in_board(particle1)  # Absorb rounding errors at the wall
+                self.predict_events(particle1)
+
+        self.event_time = end_time
+        for particle in self._event_particles.values():
+            self._sync_particle(particle)
+
+    def step(self):
+        """
+        Advances the simulation by one time step: moves the particles, resolves their collisions and
+        updates their colors. With a step_controller, the time step is chosen first.
+        """
+        start = time.perf_counter()
+        if self.interpolate:
+            count = len(self.particles)
+            self._previous_positions = np.column_stack(
+                (np.fromiter((particle.x for particle in self.particles), dtype=np.float64, count=count),
+                 np.fromiter((particle.y for particle in self.particles), dtype=np.float64, count=count)))
+
+        sampled_particles = [particle for particle in self.particles
+                             if particle.id not in self._event_particles]
+        if self.step_controller is not None:
+            self.time_step = self.step_controller.choose(self, sampled_particles)
+
+        # Move particles
+        if self.event_driven:
+            self.advance_events(self.time_step)
+        for particle in sampled_particles:
+            particle.move(self.time_step)
+        moved = time.perf_counter()
+
+        if self.contact_aware:
+            self.collision_flags = self.check_collisions(sampled_particles)
+        else:
+            self.collision_flags = list(len(self.particles) * [False])
+        collided = time.perf_counter()
+        self.update_index()
+
+        self.update_colors()
+        updated = time.perf_counter()
+
+        if self.recorder is not None:
+            self.recorder.record(self.particles, self.collision_flags)
+        if self.telemetry is not None:
+            self.telemetry.record(self.steps, self.particles, self.collision_flags)
+        self.steps += 1
+        self.simulation_time += self.time_step
+
+        self.phase_times['move'] += moved - start
+        self.phase_times['collisions'] += collided - moved
+        self.phase_times['update'] += updated - collided
+        self.phase_times['record'] += time.perf_counter() - updated
+
+    def update_colors(self):
+        """
+        Updates the color of every particle in one batch. The palette index of all the linear and
+        circular particles is computed with one vectorized comparison, and only the particles whose
+        index changed get a new color. Other kinds of particles still use their update_color method.
+        The colors are also kept as an array, which draw splats without touching the particles.
+        """
+        particles = self.particles
+        count = len(particles)
+        if len(self._color_kinds) != count:
+            self._color_kinds = np.array([1 if isinstance(particle, LinearParticle) else
+                                          2 if isinstance(particle, CircularParticle) else 0
+                                          for particle in particles], dtype=np.int64)
+            self._color_indices = np.full(count, -1)
+            self._colors = np.array([particle.color for particle in particles], dtype=np.float32).reshape(-1, 3)
+        xs = np.fromiter((particle.x for particle in particles), dtype=np.float64, count=count)
+        ys = np.fromiter((particle.y for particle in particles), dtype=np.float64, count=count)
+        indices = np.select([self._color_kinds == 1, self._color_kinds == 2],
+                            [np.where(xs < self.width // 2, ORANGE, BLUE),
+                             np.where(ys < self.height // 2, RED, GREEN)], -1)
+        changed = np.flatnonzero((indices != self._color_indices) & (indices >= 0))
+        for i in changed.tolist():
+            particles[i].color = PALETTE[indices[i]]
+        self._colors[changed] = PALETTE_RGB[indices[changed]]
+        for i in np.flatnonzero(indices < 0).tolist():
+            particles[i].update_color(self.width, self.height)
+            self._colors[i] = particles[i].color
+        self._color_indices = indices
+
+    def capture_frame(self):
+        frame = pygame.surfarray.array3d(self.screen)
+        frame = np.transpose(frame, (1, 0, 2))
+        self.frames.append(frame)
+
     def run(self):
+        """
+        Runs the simulation loop. Without a physics_rate every drawn frame advances the simulation by
+        one time step. With a physics_rate the physics runs at that fixed rate of wall time whatever the
+        frame rate is: each frame runs the steps owed since the last frame, at most max_substeps of them
+        so a slow machine drops time instead of falling further and further behind.
+        """
+        previous_time = time.perf_counter()
+        accumulator = 0.0
         running = True
         while running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    self.selected = self.particle_at(*event.pos)
 
-            # Move particles
-            for particle in self.particles:
-                particle.move(self.time_step)
-
-            if self.contact_aware:
-                self.check_collisions()
-
-            for particle in self.particles:
-                particle.update_color(self.width, self.height)
+            alpha = None
+            if self.physics_rate is None:
+                self.step()
+            else:
+                physics_period = 1 / self.physics_rate
+                current_time = time.perf_counter()
+                accumulator += current_time - previous_time
+                previous_time = current_time
+                substeps = 0
+                while accumulator >= physics_period and substeps < self.max_substeps:
+                    self.step()
+                    accumulator -= physics_period
+                    substeps += 1
+                if accumulator >= physics_period:
+                    accumulator = 0.0  # Too far behind, drop the backlog instead of spiralling
+                if self.interpolate:
+                    alpha = accumulator / physics_period
 
             # Draw everything
-            self.draw()
+            self.draw(alpha)
 
             if self.save_gif:
-                frame = pygame.surfarray.array3d(self.screen)
-                frame = np.transpose(frame, (1, 0, 2))
-                self.frames.append(frame)
+                self.capture_frame()
 
             # Update the display
             pygame.display.flip()
-            self.clock.tick(60)
+            self.clock.tick(self.render_rate)
 
         if self.save_gif:
             imageio.mimsave(self.gif_name, self.frames, fps=30, loop=0)
 
+        self.close()
         pygame.quit()
         sys.exit()
 
+    def replay(self, path, fps=60):
+        """
+        Shows a recording made with a TrajectoryRecorder instead of simulating. Left and right seek one
+        second back and forth, home and end jump to the ends and space pauses.
+        Parameters:
+            path (str): The recording to show.
+            fps (int): The number of recorded frames shown per second.
+        """
+        trajectory = TrajectoryReplay(path)
+        self.particles = trajectory.particles()
+        frame = 0
+        paused = False
+        running = len(trajectory) > 0
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        paused = not paused
+                    elif event.key == pygame.K_LEFT:
+                        frame -= fps
+                    elif event.key == pygame.K_RIGHT:
+                        frame += fps
+                    elif event.key == pygame.K_HOME:
+                        frame = 0
+                    elif event.key == pygame.K_END:
+                        frame = len(trajectory) - 1
+            frame = min(max(frame, 0), len(trajectory) - 1)
 
-if __name__ == "__main__":
-    # Screen dimensions
-    screen_width = 800
-    screen_height = 600
+            trajectory.apply(self.particles, frame)
+            self.draw()
+            pygame.display.flip()
+            self.clock.tick(fps)
+            if not paused and frame < len(trajectory) - 1:
+                frame += 1
 
-    # Create the simulator
-    simulator = Simulator(screen_width, screen_height, 0.5, gif_name="particle_simulation.gif", save_gif=True,
-                          contact_aware=True)
+    def _decode_frame(self, raw):
+        return np.frombuffer(raw, dtype=np.uint8).reshape(self.height, self.width, 3)
 
-    # Add multiple particles
-    num_particles = 5
-    particle_radius = 10
-    particles_counter = 0
+    def _apply_command(self, command):
+        """
+        Applies a control command received by run_async. Commands are tuples whose first item is
+        'pause', 'resume', 'stop', 'add_particle' (followed by the particle) or 'time_step'
+        (followed by the new time step).
+        """
+        name, *args = command
+        if name == 'add_particle':
+            self.add_particle(*args)
+        elif name == 'time_step':
+            self.time_step = args[0]
+        elif name not in ('pause', 'resume', 'stop'):
+            raise ValueError("Invalid command")
+        return name
+
+    async def run_async(self, steps=None, commands=None, frame_rate=None):
+        """
+        Runs the simulation loop as a coroutine that yields to the event loop after every frame, so it
+        can run inside a larger asyncio application. Unlike run(), it neither quits pygame nor exits the
+        interpreter; call close() and pygame.quit() when done.
+        Frames are decoded in an executor, and the GIF is written in an executor when the run ends.
+        Parameters:
+            steps (int): The number of steps to run, or None to run until a 'stop' command or the window closes.
+            commands (asyncio.Queue): A queue of control commands, see _apply_command.
+            frame_rate (float): The maximum number of frames per second, or None to run as fast as possible.
+        Returns:
+            int: The number of steps that were run.
+        """
+        loop = asyncio.get_running_loop()
+        decoded_frames = []
+        step_count = 0
+        paused = False
+        running = True
+        while running and (steps is None or step_count < steps):
+            frame_start = time.perf_counter()
+            # While paused, wait for the command that resumes or stops the run
+            while commands is not None and (paused or not commands.empty()):
+                if paused:
+                    # Keep handling window events, so the paused window still responds and can be closed
+                    if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                        running = paused = False
+                        break
+                    try:
+                        command = await asyncio.wait_for(commands.get(), timeout=PAUSE_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        continue
+                else:
+                    command = commands.get_nowait()
+                name = self._apply_command(command)
+                if name == 'pause':
+                    paused = True
+                elif name == 'resume':
+                    paused = False
+                elif name == 'stop':
+                    running = paused = False
+            if not running:
+                break
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    self.selected = self.particle_at(*event.pos)
+
+            self.step()
+            step_count += 1
+            self.draw()
+
+            if self.save_gif:
+                raw = pygame.image.tostring(self.screen, 'RGB')
+                decoded_frames.append(loop.run_in_executor(None, self._decode_frame, raw))
+
+            pygame.display.flip()
+            delay = 0 if frame_rate is None else 1 / frame_rate - (time.perf_counter() - frame_start)
+            await asyncio.sleep(max(delay, 0))
+
+        if self.save_gif:
+            self.frames.extend(await asyncio.gather(*decoded_frames))
+            await loop.run_in_executor(None, functools.partial(imageio.mimsave, self.gif_name, self.frames,
+                                                               fps=30, loop=0))
+        return step_count
+
+    def save_snapshot(self, path):
+        """
+        Saves the particles, the time step and the state of the random generator to a .npz file.
+        Every particle attribute is stored as a column, so saving is O(n) and nothing is pickled.
+        Parameters:
+            path (str): The file to write.
+        """
+        arrays = pack_objects(self.particles)
+        arrays.update(random_state())
+        arrays['time_step'] = np.array(self.time_step)
+        arrays['event_time'] = np.array(self.event_time)
+        arrays['simulation_time'] = np.array(self.simulation_time)
+        np.savez(path, **arrays)
+
+    def restore_snapshot(self, path):
+        """
+        Replaces the particles, the time step and the state of the random generator with the ones saved
+        by save_snapshot. The spatial index and the collision events are rebuilt from the particles.
+        Parameters:
+            path (str): The file to read.
+        """
+        with np.load(path) as arrays:
+            particles = unpack_objects(arrays, {'LinearParticle': LinearParticle,
+                                                 'CircularParticle': CircularParticle})
+            set_random_state(arrays)
+            self.time_step = float(arrays['time_step'])
+            self.event_time = float(arrays['event_time'])
+            if 'simulation_time' in arrays:
+                self.simulation_time = float(arrays['simulation_time'])
+
+        self.particles = []
+        self.quadtree = QuadTree(self.width, self.height)
+        self._sweep_order = []
+        self.selected = None
+        self.event_queue = []
+        self._event_particles = {}
+        self._collision_counts = {}
+        self._synced_at = {}
+        self._previous_positions = np.empty((0, 2))
+        self._color_kinds = np.empty(0, dtype=np.int64)
+        for particle in particles:
+            self.add_particle(particle)
+
+    def add_scenario(self, path):
+        """
+        Adds the particles of a scenario file written by save_scenario.
+        Parameters:
+            path (str): A .json or .npz scenario file.
+        Returns:
+            dict: The columns of the scenario, see load_scenario.
+        """
+        columns = load_scenario(path)
+        for particle in scenario_particles(columns):
+            self.add_particle(particle)
+        return columns
+
+
+def populate_scene(simulator, num_particles=5, particle_radius=10, speed=5):
+    """
+    Adds the example scene to a simulator: num_particles LinearParticles at Poisson-disk positions and
+    num_particles CircularParticles orbiting the centre of the board, alternating circles and squares.
+    Parameters:
+        simulator (Simulator): The simulator receiving the particles.
+        num_particles (int): The number of particles of each kind.
+        particle_radius (int): The radius of every particle.
+        speed (float): The x and y speed of the LinearParticles.
+    """
+    particles_counter = len(simulator.particles)
+    positions = simulator.poisson_placement(num_particles, particle_radius)
     for _ in range(num_particles):
-        x, y = simulator.random_placement(particle_radius)
-        radius = 10
-        speed_x = 5
-        speed_y = 5
+        x, y = positions[_]
         shape = 'circle' if _ % 2 == 0 else 'square'
-        simulator.add_particle(LinearParticle(particles_counter, x, y, radius, speed_x, speed_y, shape))
+        simulator.add_particle(LinearParticle(particles_counter, x, y, particle_radius, speed, speed, shape))
         particles_counter = particles_counter + 1
 
     for _ in range(num_particles):
         y = 0
-        x = screen_width // (3 * num_particles) * (_ + 1)
-        center_x = screen_width // 2
-        center_y = screen_height // 2
+        x = simulator.width // (3 * num_particles) * (_ + 1)
+        center_x = simulator.width // 2
+        center_y = simulator.height // 2
         orbit_radius = np.hypot(x, y)
         angle_speed = 0.02 * (_ % 4 + 1)
-        radius = 10
         shape = 'circle' if _ % 2 == 0 else 'square'
         simulator.add_particle(
-            CircularParticle(particles_counter, x, y, radius, center_x, center_y, orbit_radius,
+            CircularParticle(particles_counter, x, y, particle_radius, center_x, center_y, orbit_radius,
                              angle_speed, shape))
 
         particles_counter = particles_counter + 1
 
+
+# Keys of a sweep job that describe the scene, every other key is passed to the Simulator
+SCENE_PARAMETERS = ('num_particles', 'particle_radius', 'speed')
+
+
+def _sweep_job(job, params, seed, steps):
+    """
+    Worker of run_sweep. Runs one headless simulation of the example scene for the given number of
+    steps and returns its summary: the job number, its params and seed, the number of collisions, the
+    final (x, y) of every particle and the time spent in each phase. The keys of params are
+    SCENE_PARAMETERS and the arguments of the Simulator. A sweep over 100 steps runs with
+    run_sweep(_sweep_job, grid, path, 100).
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # No window in the worker processes
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    start = time.perf_counter()
+    scene = {key: value for key, value in params.items() if key in SCENE_PARAMETERS}
+    options = {key: value for key, value in params.items() if key not in SCENE_PARAMETERS}
+    options.setdefault('width', 800)
+    options.setdefault('height', 600)
+    options.setdefault('time_step', 0.5)
+    options.setdefault('contact_aware', True)  # As in the example scene of __main__
+    simulator = Simulator(gif_name=None, save_gif=False, **options)
+    try:
+        populate_scene(simulator, **scene)
+        setup_time = time.perf_counter() - start
+        collisions = 0
+        for _ in range(steps):
+            simulator.step()
+            collisions += sum(simulator.collision_flags)
+        # Collisions resolved by the event queue are not in the flags
+        collisions += simulator.event_collisions
+        timings = dict(simulator.phase_times, setup=setup_time, total=time.perf_counter() - start)
+        return {'job': job, 'params': params, 'seed': seed, 'steps': steps, 'collisions': collisions,
+                'positions': [[particle.x, particle.y] for particle in simulator.particles],
+                'timings': timings}
+    finally:
+        simulator.close()
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    # Screen dimensions
+    screen_width = 800
+    screen_height = 600
+
+    # Create the simulator
+    simulator = Simulator(screen_width, screen_height, 0.5, gif_name="particle_simulation.gif", save_gif=True,
+                          contact_aware=True)
+
+    # Add multiple particles
+    populate_scene(simulator, num_particles=5, particle_radius=10, speed=5)
+
     # Run the simulation
     simulator.run()
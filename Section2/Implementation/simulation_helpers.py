@@ -0,0 +1,201 @@
+"""
+Helpers shared by the Section 2 simulators: Part1/Function_Based.py, Part2/Class_Based_After.py and
+Part2/Exercise_Solution/particle_simulator.py. Each of them adds this folder to sys.path to import it.
+"""
+import itertools
+import json
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pygame
+
+
+def pack_objects(objects):
+    """
+    Stores the attributes of objects as columns, one group of columns per class, together with the
+    class of every object so their order can be restored. Nothing is pickled.
+    Parameters:
+        objects (list): The objects to store, whose attributes are numbers, strings or tuples of numbers.
+    Returns:
+        dict: The columns, ready for np.savez.
+    """
+    kinds = [type(obj).__name__ for obj in objects]
+    arrays = {'kinds': np.array(kinds)}
+    groups = {}
+    for obj, kind in zip(objects, kinds):
+        groups.setdefault(kind, []).append(vars(obj))
+    for kind, states in groups.items():
+        for key in states[0]:
+            column = np.array([state[key] for state in states])
+            if column.dtype == object:
+                raise ValueError("Cannot store attribute " + key + " of " + kind)
+            arrays[kind + '/' + key] = column
+    return arrays
+
+
+def unpack_objects(arrays, classes):
+    """
+    Rebuilds the objects stored by pack_objects, in order, without calling their constructors.
+    Parameters:
+        arrays (NpzFile): The loaded columns.
+        classes (dict): The class to instantiate for every class name.
+    Returns:
+        list: The objects.
+    """
+    groups = {}
+    for name in arrays.files:
+        if '/' in name:
+            kind, key = name.split('/', 1)
+            groups.setdefault(kind, {})[key] = arrays[name].tolist()
+    rows = {kind: zip(*columns.values()) for kind, columns in groups.items()}
+    objects = []
+    for kind in arrays['kinds'].tolist():
+        obj = classes[kind].__new__(classes[kind])
+        for key, value in zip(groups[kind], next(rows[kind])):
+            setattr(obj, key, tuple(value) if isinstance(value, list) else value)
+        objects.append(obj)
+    return objects
+
+
+def random_state():
+    """
+    Returns the state of the random module as arrays, ready for np.savez.
+    """
+    version, internal, gauss_next = random.getstate()
+    return {'random_version': np.array(version),
+            'random_internal': np.array(internal, dtype=np.int64),
+            'random_gauss_next': np.array(np.nan if gauss_next is None else gauss_next)}
+
+
+def set_random_state(arrays):
+    """
+    Restores the state of the random module saved by random_state.
+    Parameters:
+        arrays (NpzFile): The loaded arrays.
+    """
+    gauss_next = float(arrays['random_gauss_next'])
+    random.setstate((int(arrays['random_version']), tuple(arrays['random_internal'].tolist()),
+                     None if math.isnan(gauss_next) else gauss_next))
+
+
+def compute_init_positions_batch(screen_heights, screen_widths, solar_distances) -> np.ndarray:
+    """Return the initial position of every planet of many solar systems at once, as an (n, 2) array
+    holding the planets of the first system, then those of the second system and so on
+
+    screen_heights and screen_widths hold one size per system, or one size shared by all systems.
+    solar_distances is a 2D array with one row per system, or a list of one distance list per system
+    when the systems do not have the same number of planets.
+    >>> compute_init_positions_batch(558, [992, 1200], [[31, 31], [31, 62, 31]]).tolist()
+    [[635.5, 279.0], [775.0, 279.0], [669.75, 279.0], [809.25, 279.0], [879.0, 279.0]]
+    """
+    if isinstance(solar_distances, np.ndarray) and solar_distances.ndim == 2:
+        distances = solar_distances.astype(np.float64)
+        in_system = np.ones(distances.shape, dtype=bool)
+    else:
+        # Pad the shorter systems with zero distances, which change neither the sums nor the cumulative sums
+        lengths = np.array([len(distances) for distances in solar_distances])
+        in_system = np.arange(max(lengths, default=0)) < lengths[:, None]
+        distances = np.zeros(in_system.shape)
+        distances[in_system] = np.concatenate(solar_distances)
+
+    # Check the precondition
+    assert distances.size != 0 and in_system.any(axis=1).all()
+    screen_heights = np.broadcast_to(screen_heights, len(distances))
+    screen_widths = np.broadcast_to(screen_widths, len(distances))
+    assert np.all(screen_heights != 0)
+    assert np.all(screen_widths != 0)
+
+    # Compute the screen size and the scaling factor of every system
+    screen_sizes = np.minimum(screen_heights, screen_widths) // 2
+    scaling_factors = screen_sizes / distances.sum(axis=1)
+    # Compute the distance between each planet and its sun (the center) with one cumulative sum per system
+    distances_to_sun_in_screen = np.cumsum(distances * scaling_factors[:, None], axis=1)
+    # The outermost planet lands on the screen size up to rounding, so allow for the rounding
+    assert np.all(distances_to_sun_in_screen <= screen_sizes[:, None] * (1 + 1e-12))
+
+    init_pos = np.empty((int(in_system.sum()), 2))
+    init_pos[:, 0] = (distances_to_sun_in_screen + (screen_widths // 2)[:, None])[in_system]
+    init_pos[:, 1] = np.broadcast_to((screen_heights // 2)[:, None], in_system.shape)[in_system]
+    return init_pos
+
+
+def splat_points(screen, xs, ys, colors):
+    """
+    Draws many tiny bodies at once: the color of every point is added to the pixel it falls on in a
+    density buffer, which is clipped and blitted onto the screen in a single call.
+    Parameters:
+        screen (pygame.Surface): The surface to draw on.
+        xs (numpy.ndarray): The x-coordinates of the points.
+        ys (numpy.ndarray): The y-coordinates of the points.
+        colors (numpy.ndarray): An (n, 3) array with the color of every point.
+    """
+    width, height = screen.get_size()
+    px = xs.astype(np.int64)
+    py = ys.astype(np.int64)
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    flat = px[inside] * height + py[inside]  # surfarray arrays are indexed [x, y]
+    density = np.empty((width * height, 3), dtype=np.float32)
+    for channel in range(3):
+        density[:, channel] = np.bincount(flat, weights=colors[inside, channel], minlength=width * height)
+    np.minimum(density, 255, out=density)
+    layer = pygame.surfarray.make_surface(density.reshape(width, height, 3).astype(np.uint8))
+    screen.blit(layer, (0, 0), special_flags=pygame.BLEND_ADD)
+
+
+def save_scenario(path, columns):
+    """
+    Writes the columns of a scenario. A .json path gets a readable object with one list per column,
+    any other path an uncompressed .npz file, which loads a million particles in a fraction of a second.
+    Parameters:
+        path (str): The file to write.
+        columns (dict): A sequence of values per column, see the SCENARIO_COLUMNS of each simulator.
+    """
+    if path.endswith('.json'):
+        with open(path, 'w') as output:
+            json.dump({name: np.asarray(values).tolist() for name, values in columns.items()}, output)
+    else:
+        np.savez(path, **{name: np.asarray(values) for name, values in columns.items()})
+
+
+def parameter_grid(grid):
+    """
+    Expands a dict of parameter name -> list of values into one dict per combination of values.
+    >>> parameter_grid({'time_step': [0.1, 0.5], 'num_particles': [5]})
+    [{'time_step': 0.1, 'num_particles': 5}, {'time_step': 0.5, 'num_particles': 5}]
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_sweep(sweep_job, grid, path, steps, seed=0, repeats=1, processes=None):
+    """
+    Runs sweep_job for every combination of parameters in grid, in a process pool. Every job gets its
+    own seed, derived from seed, so a sweep is reproducible whatever order the jobs finish in. Each
+    summary is appended to path as one JSON line as soon as its job finishes, so a long sweep can be
+    inspected or resumed while it runs.
+    Parameters:
+        sweep_job (function): The _sweep_job of a simulator, called as sweep_job(job, params, seed, steps)
+            in a worker process. It runs one headless simulation and returns its summary as a dict
+            holding at least the job number.
+        grid (dict): A list of values per parameter, see parameter_grid and the sweep_job.
+        path (str): The JSON lines file receiving the summaries.
+        steps (int): The number of steps of every simulation.
+        seed (int): The seed the job seeds are derived from.
+        repeats (int): The number of runs of every combination, each with its own seed.
+        processes (int): The number of worker processes, defaults to the number of CPUs.
+    Returns:
+        list: The summaries, in job order.
+    """
+    jobs = [params for params in parameter_grid(grid) for _ in range(repeats)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(jobs), dtype=np.uint64).tolist()
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=processes) as pool, open(path, 'a') as output:
+        futures = [pool.submit(sweep_job, job, params, seeds[job], steps) for job, params in enumerate(jobs)]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['job']] = result
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    return results
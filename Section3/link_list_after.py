@@ -1,5 +1,7 @@
-from typing import Any
+from typing import Any, Callable, Optional
 
+from array import array
+from numbers import Integral
 import pygame
 import sys
 import math
@@ -8,19 +10,70 @@ import imageio
 import random
 
 
+# Bits of the packed sort key that hold y, enough for the 16-bit grid coordinates
+KEY_SHIFT = 16
+
+
+def pack_key(x: int, y: int) -> int:
+    """Return an integer that is ordered the same way as (x, y).
+
+    Precondition: x and y are integers with 0 <= x, y < 2 ** KEY_SHIFT.
+
+    >>> pack_key(1, 0) > pack_key(0, 9)
+    True
+    """
+    return (x << KEY_SHIFT) | y
+
+
+def _packable(coordinate: Any) -> bool:
+    """Return whether <coordinate> can be packed by pack_key."""
+    return isinstance(coordinate, Integral) and 0 <= coordinate < 2 ** KEY_SHIFT
+
+
 class Particle:
+    """A particle ordered by (x, y).
+
+    Particles whose coordinates can be packed compare their packed keys, the others
+    compare (x, y) itself, which orders them the same way.
+
+    >>> Particle(1, 0, 5) > Particle(0, 9, 5)
+    True
+    >>> Particle(0.5, 2, 5) < Particle(1, 0, 5) < Particle(1, 2.5, 5)
+    True
+    """
     def __init__(self, x, y, radius):
         self.x = x
         self.y = y
         self.radius = radius
+        # Compared instead of (x, y), or None if the coordinates cannot be packed
+        self.key = pack_key(int(x), int(y)) if _packable(x) and _packable(y) else None
 
     def __lt__(self, other):
-        if self.x == other.x:
-            return self.y < other.y
-        return self.x < other.x
+        if self.key is None or other.key is None:
+            if self.x == other.x:
+                return self.y < other.y
+            return self.x < other.x
+        return self.key < other.key
 
     def __eq__(self, other):
-        return self.x == other.x and self.y == other.y
+        if self.key is None or other.key is None:
+            return self.x == other.x and self.y == other.y
+        return self.key == other.key
+
+
+def _sort_batch(items: list, key: Optional[Callable[[Any], int]]) -> tuple[list, list]:
+    """Return <items> sorted and the key of every sorted item.
+
+    Without a key function the items are their own keys and are sorted with sorted().
+    Otherwise the integer keys are computed once and sorted with np.argsort, which
+    is stable like sorted().
+    """
+    if key is None:
+        batch = sorted(items)
+        return batch, batch
+    keys = np.fromiter((key(item) for item in items), dtype=np.int64, count=len(items))
+    order = np.argsort(keys, kind='stable')
+    return [items[i] for i in order.tolist()], keys[order].tolist()
 
 
 class _Node:
@@ -32,54 +85,455 @@ class _Node:
     Attributes:
     - item:
         The data stored in this node.
+    - key:
+        The value the list is ordered by, the item itself if the list has no key function.
     - next:
         The next node in the list, or None if there are no more nodes.
     """
     item: Any
+    key: Any
     next: '_Node | None'  # Fix type annotation
 
-    def __init__(self, item: Any) -> None:
-        """Initialize a new node storing <item>, with no next node.
+    def __init__(self, item: Any, key: Any = None) -> None:
+        """Initialize a new node storing <item> and <key>, with no next node.
+
+        If key is None, the item is its own key.
         """
         self.item = item
+        self.key = item if key is None else key
         self.next = None  # Initially pointing to nothing
 
     def __lt__(self, other):
-        return self.item < other.item
+        return self.key < other.key
 
     def __eq__(self, other):
-        return self.item == other.item
+        return self.key == other.key
+
+
+class _DoublyNode(_Node):
+    """A node in a doubly linked list.
+
+    Attributes:
+    - prev:
+        The previous node in the list, or None if this is the first node.
+    """
+    prev: '_DoublyNode | None'
+
+    def __init__(self, item: Any, key: Any = None) -> None:
+        """Initialize a new node storing <item> and <key>, with no previous or next node.
+        """
+        super().__init__(item, key)
+        self.prev = None
 
 
 class LinkedList:
     """A linked list implementation of the List ADT.
 
+    The items are kept in order. If the list has a key function, it is called once
+    for every inserted item and the list compares the keys it returns instead of
+    the items, so ordering by an integer key skips the items' __lt__.
+
     Private Attributes:
     - _first: The first node in this linked list, or None if this list is empty.
+    - _last: The last node in this linked list, or None if this list is empty.
+    - _key: The function returning the integer key of an item, or None to compare the items.
     """
     _first: '_Node | None'
+    _last: '_Node | None'
+    _key: Optional[Callable[[Any], int]]
 
-    def __init__(self) -> None:
-        """Initialize an empty linked list.
+    def __init__(self, key: Optional[Callable[[Any], int]] = None) -> None:
+        """Initialize an empty linked list ordered by <key>.
         """
         self._first = None
+        self._last = None
+        self._key = key
         self.size = 0
 
+    def _key_of(self, item: Any) -> Any:
+        """Return the value <item> is ordered by in this linked list."""
+        return item if self._key is None else self._key(item)
+
+    def _insert_after(self, previous: '_Node | None', item: Any, key: Any) -> _Node:
+        """Insert a new node storing <item> and <key> after <previous>, or at the
+        front if previous is None, and return the new node."""
+        new_node = _Node(item, key)
+        if previous is None:
+            new_node.next = self._first
+            self._first = new_node
+        else:
+            new_node.next = previous.next
+            previous.next = new_node
+        if new_node.next is None:
+            self._last = new_node
+        self.size += 1
+        return new_node
+
+    def _node_at(self, index: int) -> _Node:
+        """Return the node at position <index>.
+
+        Raise IndexError if index >= len(self).
+        """
+        if index >= self.size or index < 0:
+            raise IndexError("Index out of bounds")
+        if index == self.size - 1:
+            return self._last
+        current = self._first
+        for _ in range(index):
+            current = current.next
+        return current
+
     def append(self, item: Any) -> None:
         """Add the given item to link list while maintain the order."""
-        new_node = _Node(item)
-        if self._first is None or new_node < self._first:
+        key = self._key_of(item)
+        if self._first is None or key < self._first.key:
+            previous = None
+        elif self._last.key < key:
+            # The item goes at the end, so there is nothing to walk over
+            previous = self._last
+        else:
+            previous = self._first
+            while previous.next is not None and previous.next.key < key:
+                previous = previous.next
+        self._insert_after(previous, item, key)
+
+    def extend_sorted(self, items: list) -> None:
+        """Add all the given items to link list while maintain the order.
+
+        The items are sorted once and merged with the list in a single pass, so
+        adding k items to a list of length n takes O(n + k log k) instead of
+        the O(k * n) of k calls to append. Items with equal keys keep the order
+        of the batch and go before the equal items already in the list.
+
+        >>> lst = LinkedList(key=len)
+        >>> lst.extend_sorted(['ccc', 'a'])
+        >>> lst.extend_sorted(['dddd', 'bb', ''])
+        >>> list(lst)
+        ['', 'a', 'bb', 'ccc', 'dddd']
+        >>> lst.extend_sorted(['y', 'x'])
+        >>> list(lst)
+        ['', 'y', 'x', 'a', 'bb', 'ccc', 'dddd']
+        """
+        batch, keys = _sort_batch(items, self._key)
+        if not batch:
+            return
+        if self._last is not None and self._last.key < keys[0]:
+            # The whole batch goes after the last node
+            previous, following = self._last, None
+        else:
+            previous, following = None, self._first
+        for item, key in zip(batch, keys):
+            while following is not None and following.key < key:
+                previous = following
+                following = following.next
+            previous = self._insert_after(previous, item, key)
+
+    def __iter__(self):
+        """Yield the items of this linked list from first to last."""
+        current = self._first
+        while current is not None:
+            yield current.item
+            current = current.next
+
+    def get(self, index: int) -> Any:
+        """Return the item at position <index> in this linked list.
+
+        Raise IndexError if index >= len(self).
+        """
+        return self._node_at(index).item
+
+    def peek(self) -> Any:
+        """Return the first item in this linked list without removing it.
+
+        Raise IndexError if this list is empty.
+
+        >>> lst = LinkedList()
+        >>> lst.extend_sorted([2, 1])
+        >>> lst.peek(), lst.peek_last()
+        (1, 2)
+        """
+        if self._first is None:
+            raise IndexError("Peek from an empty list")
+        return self._first.item
+
+    def peek_last(self) -> Any:
+        """Return the last item in this linked list without removing it.
+
+        Raise IndexError if this list is empty.
+        """
+        if self._last is None:
+            raise IndexError("Peek from an empty list")
+        return self._last.item
+
+    def pop(self, index: int) -> Any:
+        """Remove and return node at position <index>.
+
+        Precondition: index >= 0.
+
+        Raise IndexError if index >= len(self).
+        """
+        if index >= self.size or index < 0:
+            raise IndexError("Index out of bounds")
+        if index == 0:
+            previous = None
+            removed = self._first
+            self._first = removed.next
+        else:
+            previous = self._first
+            for _ in range(index - 1):
+                previous = previous.next
+            removed = previous.next
+            previous.next = removed.next
+        if removed is self._last:
+            self._last = previous
+        self.size -= 1
+        return removed.item
+
+    def popleft(self) -> Any:
+        """Remove and return the first item in this linked list.
+
+        Raise IndexError if this list is empty.
+
+        >>> lst = LinkedList()
+        >>> lst.extend_sorted([3, 1, 2])
+        >>> lst.popleft(), lst.popleft(), lst.size
+        (1, 2, 1)
+        """
+        return self.pop(0)
+
+    def pop_last(self) -> Any:
+        """Remove and return the last item in this linked list.
+
+        A singly linked node does not know the node before it, so this walks the
+        whole list. Use DoublyLinkedList when the last item is popped often.
+
+        Raise IndexError if this list is empty.
+
+        >>> lst = LinkedList()
+        >>> lst.extend_sorted([3, 1, 2])
+        >>> lst.pop_last(), lst.pop_last(), lst.peek_last()
+        (3, 2, 1)
+        """
+        return self.pop(self.size - 1)
+
+
+class DoublyLinkedList(LinkedList):
+    """A linked list whose nodes also point to the node before them.
+
+    Removing the first or the last item takes constant time, so the list can be
+    used as a FIFO queue or a deque. append walks from the last node backwards,
+    so items that belong near the end are inserted quickly, and get and pop walk
+    from whichever end of the list is closer to <index>. An appended item goes
+    before the items with an equal key.
+
+    >>> queue = DoublyLinkedList(key=len)
+    >>> for item in ['bb', 'a', 'cc', 'b']:
+    ...     queue.append(item)
+    >>> list(queue)
+    ['b', 'a', 'cc', 'bb']
+    >>> queue.popleft(), queue.pop_last(), queue.pop_last(), queue.popleft()
+    ('b', 'bb', 'cc', 'a')
+    >>> queue.pop_last()
+    Traceback (most recent call last):
+    IndexError: Index out of bounds
+    """
+    _first: '_DoublyNode | None'
+    _last: '_DoublyNode | None'
+
+    def _insert_after(self, previous: '_DoublyNode | None', item: Any, key: Any) -> _DoublyNode:
+        """Insert a new node storing <item> and <key> after <previous>, or at the
+        front if previous is None, and return the new node."""
+        new_node = _DoublyNode(item, key)
+        new_node.prev = previous
+        if previous is None:
             new_node.next = self._first
             self._first = new_node
         else:
+            new_node.next = previous.next
+            previous.next = new_node
+        if new_node.next is None:
+            self._last = new_node
+        else:
+            new_node.next.prev = new_node
+        self.size += 1
+        return new_node
+
+    def _node_at(self, index: int) -> _DoublyNode:
+        """Return the node at position <index>, walking from the closer end.
+
+        Raise IndexError if index >= len(self).
+        """
+        if index >= self.size or index < 0:
+            raise IndexError("Index out of bounds")
+        if index < self.size // 2:
             current = self._first
-            while current.next is not None and current.next < new_node:
+            for _ in range(index):
                 current = current.next
-            new_node.next = current.next
-            current.next = new_node
+        else:
+            current = self._last
+            for _ in range(self.size - 1 - index):
+                current = current.prev
+        return current
+
+    def _unlink(self, node: _DoublyNode) -> Any:
+        """Remove <node> from this linked list and return its item."""
+        if node.prev is None:
+            self._first = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self._last = node.prev
+        else:
+            node.next.prev = node.prev
+        self.size -= 1
+        return node.item
+
+    def append(self, item: Any) -> None:
+        """Add the given item to link list while maintain the order."""
+        # The nodes before the new one are exactly the nodes smaller than it
+        key = self._key_of(item)
+        previous = self._last
+        while previous is not None and not previous.key < key:
+            previous = previous.prev
+        self._insert_after(previous, item, key)
+
+    def pop(self, index: int) -> Any:
+        """Remove and return node at position <index>.
+
+        Precondition: index >= 0.
+
+        Raise IndexError if index >= len(self).
+        """
+        return self._unlink(self._node_at(index))
+
+    def pop_last(self) -> Any:
+        """Remove and return the last item in this linked list.
+
+        Raise IndexError if this list is empty.
+        """
+        if self._last is None:
+            raise IndexError("Index out of bounds")
+        return self._unlink(self._last)
+
+
+class PooledLinkedList:
+    """A linked list implementation of the List ADT whose nodes live in preallocated arrays.
+
+    The items are integers, such as the index of a cell of a ParticleGrid, and node i
+    is made of _items[i], _keys[i] and _next[i]: a few bytes each, with no Python
+    object per node. _next links both the list and the free slots. Like LinkedList,
+    the list is ordered by the integer keys of its key function, or by the items
+    themselves if there is none. Popped slots go back to the free list and are reused
+    by the next insertion, so once the arrays are large enough, filling and draining
+    the list allocates nothing. The arrays double in size when every slot is used.
+
+    Private Attributes:
+    - _items: The item stored in every slot.
+    - _keys: The key of the item stored in every slot.
+    - _next: The slot following every slot, or -1 at the end of a chain.
+    - _first: The first slot of this linked list, or -1 if this list is empty.
+    - _free: The first free slot, or -1 if every slot is used.
+    - _key: The function returning the integer key of an item, or None to compare the items.
+    """
+    _items: array
+    _keys: array
+    _next: array
+    _first: int
+    _free: int
+    _key: Optional[Callable[[int], int]]
+
+    def __init__(self, capacity: int = 16, key: Optional[Callable[[int], int]] = None) -> None:
+        """Initialize an empty linked list ordered by <key>, with room for <capacity> items.
+        """
+        self._items = array('l')
+        self._keys = array('q')
+        self._next = array('l')
+        self._first = -1
+        self._free = -1
+        self._key = key
+        self.size = 0
+        self._grow(max(capacity, 1))
+
+    def _grow(self, capacity: int) -> None:
+        """Add free slots until there are <capacity> slots."""
+        old_capacity = len(self._items)
+        self._items.extend(array('l', [0]) * (capacity - old_capacity))
+        self._keys.extend(array('q', [0]) * (capacity - old_capacity))
+        self._next.extend(range(old_capacity + 1, capacity + 1))
+        self._next[-1] = self._free
+        self._free = old_capacity
+
+    def _allocate(self, item: int, key: int) -> int:
+        """Store <item> and <key> in a free slot and return the slot."""
+        if self._free == -1:
+            self._grow(2 * len(self._items))
+        slot = self._free
+        self._free = self._next[slot]
+        self._items[slot] = item
+        self._keys[slot] = key
+        return slot
+
+    def _release(self, slot: int) -> int:
+        """Put <slot> back on the free list and return the item it stored."""
+        self._next[slot] = self._free
+        self._free = slot
+        return self._items[slot]
+
+    def append(self, item: int) -> None:
+        """Add the given item to link list while maintain the order."""
+        key = item if self._key is None else self._key(item)
+        slot = self._allocate(item, key)
+        keys = self._keys
+        if self._first == -1 or key < keys[self._first]:
+            self._next[slot] = self._first
+            self._first = slot
+        else:
+            current = self._first
+            while self._next[current] != -1 and keys[self._next[current]] < key:
+                current = self._next[current]
+            self._next[slot] = self._next[current]
+            self._next[current] = slot
         self.size += 1
 
-    def get(self, index: int) -> Any:
+    def extend_sorted(self, items: list[int]) -> None:
+        """Add all the given items to link list while maintain the order.
+
+        Same as LinkedList.extend_sorted: one sort of the items and one pass over the list.
+
+        >>> pool = PooledLinkedList(capacity=2, key=lambda cell: cell // 10)
+        >>> pool.extend_sorted([35, 12])
+        >>> pool.extend_sorted([41, 20, 5])
+        >>> list(pool)
+        [5, 12, 20, 35, 41]
+        >>> pool.extend_sorted([13, 11])
+        >>> list(pool)
+        [5, 13, 11, 12, 20, 35, 41]
+        """
+        batch, batch_keys = _sort_batch(items, self._key)
+        keys = self._keys
+        previous = -1  # -1 stands for the position in front of the first slot
+        for item, key in zip(batch, batch_keys):
+            slot = self._allocate(item, key)
+            following = self._first if previous == -1 else self._next[previous]
+            while following != -1 and keys[following] < key:
+                previous = following
+                following = self._next[following]
+            self._next[slot] = following
+            if previous == -1:
+                self._first = slot
+            else:
+                self._next[previous] = slot
+            previous = slot
+            self.size += 1
+
+    def __iter__(self):
+        """Yield the items of this linked list from first to last."""
+        current = self._first
+        while current != -1:
+            yield self._items[current]
+            current = self._next[current]
+
+    def get(self, index: int) -> int:
         """Return the item at position <index> in this linked list.
 
         Raise IndexError if index >= len(self).
@@ -88,10 +542,10 @@ class LinkedList:
             raise IndexError("Index out of bounds")
         current = self._first
         for _ in range(index):
-            current = current.next
-        return current.item
+            current = self._next[current]
+        return self._items[current]
 
-    def pop(self, index: int) -> Any:
+    def pop(self, index: int) -> int:
         """Remove and return node at position <index>.
 
         Precondition: index >= 0.
@@ -101,34 +555,137 @@ class LinkedList:
         if index >= self.size or index < 0:
             raise IndexError("Index out of bounds")
         if index == 0:
-            removed_item = self._first.item
-            self._first = self._first.next
+            removed = self._first
+            self._first = self._next[removed]
         else:
             current = self._first
             for _ in range(index - 1):
-                current = current.next
-            removed_item = current.next.item
-            current.next = current.next.next
+                current = self._next[current]
+            removed = self._next[current]
+            self._next[current] = self._next[removed]
         self.size -= 1
-        return removed_item
+        return self._release(removed)
+
+    def peek(self) -> int:
+        """Return the first item in this linked list without removing it.
+
+        Raise IndexError if this list is empty.
+        """
+        if self._first == -1:
+            raise IndexError("Peek from an empty list")
+        return self._items[self._first]
+
+    def popleft(self) -> int:
+        """Remove and return the first item in this linked list.
+
+        Raise IndexError if this list is empty.
+
+        >>> pool = PooledLinkedList(capacity=2)
+        >>> pool.extend_sorted([7, 3, 7])
+        >>> [pool.popleft() for _ in range(pool.size)]
+        [3, 7, 7]
+        >>> pool.peek()
+        Traceback (most recent call last):
+        IndexError: Peek from an empty list
+        """
+        return self.pop(0)
+
+
+class ParticleGrid:
+    """A grid of particle positions that only creates a Particle when a cell is used.
+
+    Only the x-coordinates of the columns and the y-coordinates of the rows are
+    stored, as unsigned 16-bit arrays, so memory grows with cols + rows instead of
+    with the number of cells. The cell at <index> lies at column index % cols and
+    row index // cols.
+
+    Attributes:
+    - spacing:
+        The distance between two neighbouring cells, also the offset of the first cell.
+    - radius:
+        The radius of the particles of the grid.
+    - xs:
+        The x-coordinate of every column.
+    - ys:
+        The y-coordinate of every row.
+    """
+    spacing: int
+    radius: int
+    xs: array
+    ys: array
+
+    def __init__(self, width: int, height: int, spacing: int, radius: int) -> None:
+        """Initialize a grid covering a <width> x <height> screen.
+
+        Raise ValueError if spacing or radius is not positive, or if the screen
+        does not fit in 16-bit coordinates.
+        """
+        if spacing <= 0 or radius <= 0:
+            raise ValueError("Spacing and radius must be positive")
+        if max(width, height) > 0xFFFF:
+            raise ValueError("Screen too large for 16-bit coordinates")
+        self.spacing = spacing
+        self.radius = radius
+        self.xs = array('H', range(spacing, width, spacing))
+        self.ys = array('H', range(spacing, height, spacing))
+
+    def __len__(self) -> int:
+        return len(self.xs) * len(self.ys)
+
+    def position(self, index: int) -> tuple[int, int]:
+        """Return the (x, y) position of the cell <index> without creating a Particle.
+
+        Raise IndexError if index >= len(self).
+        """
+        if index >= len(self) or index < 0:
+            raise IndexError("Index out of bounds")
+        row, col = divmod(index, len(self.xs))
+        return self.xs[col], self.ys[row]
+
+    def key(self, index: int) -> int:
+        """Return the packed key of the cell <index>, ordered the same way as its (x, y).
+
+        Raise IndexError if index >= len(self).
+        """
+        return pack_key(*self.position(index))
+
+    def __getitem__(self, index: int) -> Particle:
+        """Return a new Particle at the cell <index>.
+
+        Raise IndexError if index >= len(self).
+        """
+        x, y = self.position(index)
+        return Particle(x, y, self.radius)
 
 
 class Simulator:
     def __init__(self, width, height, max_particles,
-                 save_gif=False, gif_name='simulation.gif'):
+                 save_gif=False, gif_name='simulation.gif', spacing=10, radius=5,
+                 particles_per_frame=1, node_pool=False):
         self.clock = None
         self.screen = None
         self.width = width
         self.height = height
-        self.inserted_particles = LinkedList()
+        self.spacing = spacing
+        self.radius = radius
+        self.node_pool = node_pool
+        self.max_added_particles = max_particles
+        self.total_particles_pos = ParticleGrid(width, height, spacing, radius)
+        # The grid cells of the inserted particles, ordered by their position
+        self.inserted_particles = self._new_list()
         self.save_gif = save_gif
         self.gif_name = gif_name
-        self.total_particles_pos = list()
-        self.max_added_particles = max_particles
         self.added_particles_cnt = 0
-        self.mark_particles = list()
+        self.particles_per_frame = particles_per_frame
+        self.mark_particles = set()  # indices of the cells already picked
         self.frames = []
 
+    def _new_list(self):
+        """Return an empty list for the grid cells of the inserted particles, pooled if node_pool is set."""
+        if self.node_pool:
+            return PooledLinkedList(self.max_added_particles, key=self.total_particles_pos.key)
+        return LinkedList(key=self.total_particles_pos.key)
+
     def init_pygame(self):
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height))
@@ -146,26 +703,32 @@ class Simulator:
     def draw(self):
         self.screen.fill((0, 0, 0))  # Fill the screen with black
         if self.added_particles_cnt < self.max_added_particles:
-            # pick a random particle from total_particles_pos using index
-            index = -1
-            while index == -1 or self.mark_particles[index] is True:
-                index = int(random.uniform(0, len(self.total_particles_pos)))
-            self.mark_particles[index] = True
-            # Add the particle to inserted_particles
-            self.inserted_particles.append(self.total_particles_pos[index])
+            count = min(self.particles_per_frame,
+                        self.max_added_particles - self.added_particles_cnt)
+            new_cells = []
+            for _ in range(count):
+                # pick a random particle from total_particles_pos using index
+                index = -1
+                while index == -1 or index in self.mark_particles:
+                    index = int(random.uniform(0, len(self.total_particles_pos)))
+                self.mark_particles.add(index)
+                new_cells.append(index)
+            # Add the particles to inserted_particles in one pass
+            self.inserted_particles.extend_sorted(new_cells)
             # Increase the counter
-            self.added_particles_cnt += 1
+            self.added_particles_cnt += count
         else:  # remove a particle from the inserted_particles
             # if the list is not empty then remove one particle
             if self.inserted_particles.size > 0:
-                self.inserted_particles.pop(0)
+                self.inserted_particles.popleft()
             else:
                 # Reset the process
                 self.added_particles_cnt = 0
-                self.mark_particles = [False] * len(self.total_particles_pos)
+                self.mark_particles = set()
 
         for idx in range(self.inserted_particles.size):
-            particle = self.inserted_particles.get(idx)
+            # The Particle only lives while it is drawn
+            particle = self.total_particles_pos[self.inserted_particles.get(idx)]
             pygame.draw.circle(self.screen, self.get_color(particle),
                                (int(particle.x), int(particle.y)),
                                particle.radius)
@@ -173,8 +736,6 @@ class Simulator:
     def run(self):
         self.init_pygame()
         self.compute_total_particles_position()
-        #an array of false values
-        self.mark_particles = [False] * len(self.total_particles_pos)
         running = True
         while running:
             for event in pygame.event.get():
@@ -197,11 +758,41 @@ class Simulator:
         pygame.quit()
         sys.exit()
 
+    def save_snapshot(self, path: str) -> None:
+        """Save the inserted particles, the marks, the grid they index and the random generator state to a .npz file."""
+        version, internal, gauss_next = random.getstate()
+        np.savez(path,
+                 grid=np.array([self.width, self.height, self.spacing, self.radius]),
+                 cells=np.array(list(self.inserted_particles), dtype=np.int64),
+                 mark_particles=np.array(sorted(self.mark_particles), dtype=np.int64),
+                 added_particles_cnt=np.array(self.added_particles_cnt),
+                 random_version=np.array(version),
+                 random_internal=np.array(internal, dtype=np.int64),
+                 random_gauss_next=np.array(np.nan if gauss_next is None else gauss_next))
+
+    def restore_snapshot(self, path: str) -> None:
+        """Restore the state saved by save_snapshot, which must come from a simulator with the same grid."""
+        with np.load(path) as arrays:
+            if arrays['grid'].tolist() != [self.width, self.height, self.spacing, self.radius]:
+                raise ValueError("Snapshot was saved with a different grid")
+            cells = arrays['cells'].tolist()
+            self.mark_particles = set(arrays['mark_particles'].tolist())
+            self.added_particles_cnt = int(arrays['added_particles_cnt'])
+            gauss_next = float(arrays['random_gauss_next'])
+            random.setstate((int(arrays['random_version']), tuple(arrays['random_internal'].tolist()),
+                             None if math.isnan(gauss_next) else gauss_next))
+
+        self.inserted_particles = self._new_list()
+        # The cells were saved in order, so inserting them from the last one only touches the head
+        for cell in reversed(cells):
+            self.inserted_particles.append(cell)
+
     def compute_total_particles_position(self) -> None:
-        for h in range(10, self.height, 10):
-            for w in range(10, self.width, 10):
-                particle = Particle(w, h, 5)
-                self.total_particles_pos.append(particle)
+        """Set up the grid of positions the particles are picked from.
+
+        The grid is lazy, so this takes constant time and memory whatever the screen size.
+        """
+        self.total_particles_pos = ParticleGrid(self.width, self.height, self.spacing, self.radius)
 
 
 if __name__ == "__main__":
@@ -212,7 +803,9 @@ if __name__ == "__main__":
     SAVE_GIF = True
     GIF_NAME = 'animation.gif'
     MAX_NUM_PARTICLES = 100
+    GRID_SPACING = 10
+    PARTICLE_RADIUS = 5
 
     simulator = Simulator(SCREEN_WIDTH, SCREEN_HEIGHT, MAX_NUM_PARTICLES,
-                          SAVE_GIF, GIF_NAME)
+                          SAVE_GIF, GIF_NAME, GRID_SPACING, PARTICLE_RADIUS)
     simulator.run()